@@ -0,0 +1,34 @@
+"""add indexes for votes.post_id and posts.owner_id lookups
+
+Revision ID: 4b8e2f6a9c13
+Revises: 9d3e7b1c5a28
+Create Date: 2026-10-18 15:40:26.118342
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b8e2f6a9c13'
+down_revision: Union[str, Sequence[str], None] = '9d3e7b1c5a28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY doesn't block writes to the tables but can't run inside a transaction.
+    # If a build fails it leaves an INVALID index behind: drop it before running the upgrade again.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_votes_post_id', 'votes', ['post_id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_posts_owner_id_created_at', 'posts', ['owner_id', 'created_at', 'id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_posts_owner_id_created_at', table_name='posts', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_votes_post_id', table_name='votes', postgresql_concurrently=True, if_exists=True)
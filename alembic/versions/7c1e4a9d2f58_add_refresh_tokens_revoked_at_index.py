@@ -0,0 +1,31 @@
+"""add index on refresh_tokens.revoked_at for the purge
+
+Revision ID: 7c1e4a9d2f58
+Revises: 4b8e2f6a9c13
+Create Date: 2026-10-18 16:05:12.402917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1e4a9d2f58'
+down_revision: Union[str, Sequence[str], None] = '4b8e2f6a9c13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Built CONCURRENTLY so logins and refreshes keep writing while it runs (see 4b8e2f6a9c13)
+    with op.get_context().autocommit_block():
+        op.create_index('ix_refresh_tokens_revoked_at', 'refresh_tokens', ['revoked_at'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_refresh_tokens_revoked_at', table_name='refresh_tokens', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,43 @@
+"""add post_scores table for trending posts
+
+Revision ID: 9d3e7b1c5a28
+Revises: f2b6d8c4a017
+Create Date: 2026-10-18 15:02:11.583920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d3e7b1c5a28'
+down_revision: Union[str, Sequence[str], None] = 'f2b6d8c4a017'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('post_scores',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('post_id')
+    )
+    op.create_index('ix_post_scores_score_post_id', 'post_scores', [sa.text('score DESC'), sa.text('post_id DESC')], unique=False)
+    # Score the last week of posts with the default settings (see app/trending.py); the app's
+    # background refresh corrects them if TRENDING_* is configured differently
+    op.execute("""
+        INSERT INTO post_scores (post_id, score)
+        SELECT id, log(greatest(vote_count, 1)) + (extract(epoch FROM created_at)::float8 - 1767225600) / 45000
+        FROM posts
+        WHERE created_at >= now() - interval '7 days'
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_post_scores_score_post_id', table_name='post_scores')
+    op.drop_table('post_scores')
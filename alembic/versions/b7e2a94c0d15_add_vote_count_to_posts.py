@@ -0,0 +1,37 @@
+"""add vote_count to posts
+
+Revision ID: b7e2a94c0d15
+Revises: 3c9d1f7a2b64
+Create Date: 2026-10-18 11:03:54.118630
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e2a94c0d15'
+down_revision: Union[str, Sequence[str], None] = '3c9d1f7a2b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('posts', sa.Column('vote_count', sa.Integer(), server_default=sa.text('0'), nullable=False))
+    # Backfill the counter from the existing votes
+    op.execute(
+        """
+        UPDATE posts
+        SET vote_count = v.votes
+        FROM (SELECT post_id, count(*) AS votes FROM votes GROUP BY post_id) AS v
+        WHERE posts.id = v.post_id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('posts', 'vote_count')
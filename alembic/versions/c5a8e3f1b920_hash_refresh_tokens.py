@@ -0,0 +1,69 @@
+"""hash refresh tokens and index them for revocation and purging
+
+Revision ID: c5a8e3f1b920
+Revises: e41f6c8d92a3
+Create Date: 2026-10-18 14:02:11.583207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5a8e3f1b920'
+down_revision: Union[str, Sequence[str], None] = 'e41f6c8d92a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Rows hashed per UPDATE: each batch is its own short transaction
+BACKFILL_BATCH_SIZE = 10000
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # refresh_tokens is the largest table and every login and refresh writes to it, so nothing here
+    # holds a lock on it for longer than one batch or a catalog change (see 4b8e2f6a9c13)
+    op.add_column('refresh_tokens', sa.Column('token_hash', sa.String(length=64), nullable=True))
+    with op.get_context().autocommit_block():
+        # Hash the stored tokens in place, so refresh tokens already issued keep working
+        connection = op.get_bind()
+        # Offline (--sql), only the catch-all UPDATE below is emitted
+        max_id = 0 if op.get_context().as_sql else connection.scalar(sa.text("SELECT max(id) FROM refresh_tokens")) or 0
+        for low in range(0, max_id, BACKFILL_BATCH_SIZE):
+            connection.execute(
+                sa.text(
+                    "UPDATE refresh_tokens SET token_hash = encode(sha256(convert_to(token, 'UTF8')), 'hex') "
+                    "WHERE id > :low AND id <= :high AND token_hash IS NULL"
+                ),
+                {"low": low, "high": low + BACKFILL_BATCH_SIZE},
+            )
+        # Tokens issued while the batches ran (or every token, offline)
+        op.execute("UPDATE refresh_tokens SET token_hash = encode(sha256(convert_to(token, 'UTF8')), 'hex') WHERE token_hash IS NULL")
+
+        # SET NOT NULL would scan the whole table under an exclusive lock; a validated CHECK
+        # (validation only blocks schema changes) lets Postgres skip that scan
+        op.execute("ALTER TABLE refresh_tokens ADD CONSTRAINT ck_refresh_tokens_token_hash_not_null CHECK (token_hash IS NOT NULL) NOT VALID")
+        op.execute("ALTER TABLE refresh_tokens VALIDATE CONSTRAINT ck_refresh_tokens_token_hash_not_null")
+        op.alter_column('refresh_tokens', 'token_hash', nullable=False)
+        op.drop_constraint('ck_refresh_tokens_token_hash_not_null', 'refresh_tokens', type_='check')
+
+        # If a build fails it leaves an INVALID index behind: drop it before running the upgrade again
+        op.create_index(op.f('ix_refresh_tokens_token_hash'), 'refresh_tokens', ['token_hash'], unique=True, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_refresh_tokens_user_id_is_revoked', 'refresh_tokens', ['user_id', 'is_revoked'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_refresh_tokens_expires_at', 'refresh_tokens', ['expires_at'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index(op.f('ix_refresh_tokens_token'), table_name='refresh_tokens', postgresql_concurrently=True, if_exists=True)
+        op.drop_column('refresh_tokens', 'token')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # The plain tokens can't be recovered: every refresh token issued so far stops working
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_refresh_tokens_expires_at', table_name='refresh_tokens', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_refresh_tokens_user_id_is_revoked', table_name='refresh_tokens', postgresql_concurrently=True, if_exists=True)
+        op.drop_index(op.f('ix_refresh_tokens_token_hash'), table_name='refresh_tokens', postgresql_concurrently=True, if_exists=True)
+        op.alter_column('refresh_tokens', 'token_hash', new_column_name='token', type_=sa.String())
+        op.create_index(op.f('ix_refresh_tokens_token'), 'refresh_tokens', ['token'], unique=True, postgresql_concurrently=True, if_not_exists=True)
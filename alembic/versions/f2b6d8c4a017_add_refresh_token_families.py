@@ -0,0 +1,35 @@
+"""add refresh token families and revocation time
+
+Revision ID: f2b6d8c4a017
+Revises: c5a8e3f1b920
+Create Date: 2026-10-18 14:31:47.209114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2b6d8c4a017'
+down_revision: Union[str, Sequence[str], None] = 'c5a8e3f1b920'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('refresh_tokens', sa.Column('revoked_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('refresh_tokens', sa.Column('family_id', sa.Uuid(), nullable=True))
+    # Existing tokens each start their own family; the exact revocation time of old rows is unknown
+    op.execute("UPDATE refresh_tokens SET family_id = gen_random_uuid(), revoked_at = CASE WHEN is_revoked THEN created_at END")
+    op.alter_column('refresh_tokens', 'family_id', nullable=False)
+    op.create_index(op.f('ix_refresh_tokens_family_id'), 'refresh_tokens', ['family_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_refresh_tokens_family_id'), table_name='refresh_tokens')
+    op.drop_column('refresh_tokens', 'family_id')
+    op.drop_column('refresh_tokens', 'revoked_at')
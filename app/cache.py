@@ -0,0 +1,225 @@
+"""
+Caches. TTLCache and MemoryCacheBackend are per worker process: entries are not shared between
+uvicorn workers, so invalidation only reaches the worker it runs in and TTLs bound staleness elsewhere.
+RedisCacheBackend shares the response cache (and its invalidations) between all workers.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import cache
+from fastapi import Request, Response, status
+from .config import settings
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire `ttl` seconds after being set. Thread-safe."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float | None = None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MemoryCacheBackend:
+    """Response cache storage inside the worker process (LRU bounded)."""
+
+    def __init__(self, maxsize: int):
+        self._entries = TTLCache(maxsize=maxsize, ttl=0)
+        self._counters = {}  # key -> (expires_at, value)
+        self._next_sweep = 0
+        self._lock = threading.Lock()
+
+    async def get(self, key: str):
+        return self._entries.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self._entries.set(key, value, ttl=ttl)
+
+    async def delete(self, key: str):
+        self._entries.delete(key)
+
+    async def get_counter(self, key: str) -> int:
+        item = self._counters.get(key)
+        return item[1] if item is not None and item[0] > time.monotonic() else 0
+
+    async def incr(self, key: str, ttl: float) -> int:
+        now = time.monotonic()
+        with self._lock:
+            item = self._counters.get(key)
+            value = item[1] + 1 if item is not None and item[0] > now else time.time_ns()
+            self._counters[key] = (now + ttl, value)
+            # Counters expire unread (most scopes are bumped once), so drop them from time to time
+            if now >= self._next_sweep:
+                self._counters = {name: entry for name, entry in self._counters.items() if entry[0] > now}
+                self._next_sweep = now + ttl
+            return value
+
+
+class RedisCacheBackend:
+    """
+    Response cache storage shared by all workers. Works with any asyncio client exposing the
+    redis-py get/set/delete/incr/pexpire methods (redis, valkey, or a local fake in tests).
+    """
+
+    def __init__(self, client, prefix: str = "response-cache:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key: str):
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self.client.set(self.prefix + key, value, px=int(ttl * 1000))
+
+    async def delete(self, key: str):
+        await self.client.delete(self.prefix + key)
+
+    async def get_counter(self, key: str) -> int:
+        return int(await self.client.get(self.prefix + key) or 0)
+
+    async def incr(self, key: str, ttl: float) -> int:
+        key = self.prefix + key
+        await self.client.set(key, time.time_ns(), nx=True, px=int(ttl * 1000))
+        value = await self.client.incr(key)
+        await self.client.pexpire(key, int(ttl * 1000))
+        return value
+
+
+class NullCacheBackend:
+    """Stores nothing. ETags and 304s still work, every request just recomputes the body."""
+
+    async def get(self, key: str):
+        return None
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        pass
+
+    async def delete(self, key: str):
+        pass
+
+    async def get_counter(self, key: str) -> int:
+        return 0
+
+    async def incr(self, key: str, ttl: float) -> int:
+        return 0
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    headers: dict
+    etag: str
+
+    def to_response(self, request: Request) -> Response:
+        """Build the HTTP response, or a 304 if the client already has this version."""
+        headers = {"ETag": self.etag, **self.headers}
+        if _etag_matches(request.headers.get("if-none-match"), self.etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [value.strip().removeprefix("W/") for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+class ResponseCache:
+    """
+    Caches serialized JSON responses. Keys live in a scope ("feed", "post:<id>") whose version
+    number is part of every key, so invalidating a scope is a single counter bump and a response
+    computed before an invalidation is never served after it.
+
+    Version counters expire VERSION_TTL_FACTOR times later than the entries stored under them, so
+    they don't pile up for every post ever changed. A counter that expired reads as 0 again, but
+    only entries stored while it was missing use version 0, and those are long gone by then; the
+    next bump restarts it from the clock, past every version it had before.
+    """
+
+    VERSION_TTL_FACTOR = 10
+
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.version_ttl = max(self.ttl * self.VERSION_TTL_FACTOR, 60)
+
+    async def _versioned_key(self, scope: str, key: str) -> str:
+        version = await self.backend.get_counter(f"version:{scope}")
+        return f"{scope}:{version}:{key}"
+
+    async def lookup(self, scope: str, key: str = ""):
+        """Returns (cached response or None, storage key to pass to store())."""
+        versioned_key = await self._versioned_key(scope, key)
+        raw = await self.backend.get(versioned_key)
+        if raw is None:
+            return None, versioned_key
+        data = json.loads(raw)
+        return CachedResponse(body=data["body"].encode(), headers=data["headers"], etag=data["etag"]), versioned_key
+
+    async def store(self, versioned_key: str, body: bytes, headers: dict | None = None) -> CachedResponse:
+        entry = CachedResponse(body=body, headers=headers or {}, etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+        raw = json.dumps({"body": body.decode(), "headers": entry.headers, "etag": entry.etag})
+        await self.backend.set(versioned_key, raw.encode(), self.ttl)
+        return entry
+
+    async def invalidate(self, *scopes: str):
+        for scope in scopes:
+            await self.backend.incr(f"version:{scope}", self.version_ttl)
+
+
+def _build_backend():
+    backend = settings.response_cache_backend
+    if backend == "memory":
+        return MemoryCacheBackend(maxsize=settings.response_cache_size)
+    if backend == "redis":
+        try:
+            import redis.asyncio as redis
+        except ImportError as error:
+            raise RuntimeError("RESPONSE_CACHE_BACKEND=redis needs the `redis` package installed") from error
+        return RedisCacheBackend(redis.from_url(settings.response_cache_url))
+    if backend == "none":
+        return NullCacheBackend()
+    raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {backend!r}")
+
+# Shared cache for the public post feed/detail responses, built on first use (the lifespan builds it at startup)
+@cache
+def get_response_cache() -> ResponseCache:
+    return ResponseCache(_build_backend(), ttl=settings.response_cache_ttl_seconds)
@@ -1,3 +1,4 @@
+from functools import cache
 from pydantic_settings import BaseSettings
 
 # Load environment variables from .env file
@@ -11,9 +12,129 @@ class Settings(BaseSettings):
     algorithm: str
     access_token_expire_minutes: int
     refresh_token_expire_days: int
+
+    # Use the asyncio engine/AsyncSession instead of a blocking Session on the threadpool
+    database_async: bool = False
+
+    # Connection pool (per worker process). Defaults match SQLAlchemy's own defaults.
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_pool_timeout: float = 30  # seconds to wait for a free connection before raising
+    database_pool_recycle: int = -1  # seconds after which a connection is replaced, -1 disables
+    database_pool_pre_ping: bool = False  # test connections on checkout (survives db/proxy restarts)
+    database_pool_prewarm: bool = True  # open pool_size connections at worker startup instead of on the first requests
+    database_statement_timeout_ms: int = 0  # server side statement_timeout, 0 disables
+    # Set when an external pooler (PgBouncer in transaction mode) sits in front of Postgres:
+    # disables the in-process pool (NullPool) and psycopg's server-side prepared statements
+    database_external_pooler: bool = False
+    
+    # Read replicas: comma-separated host[:port], same credentials and database name as the primary.
+    # GET /posts/, /posts/{id} and /users/{id} read from them round-robin (empty = everything on the primary)
+    database_replica_hostnames: str = ""
+    database_replica_health_check_seconds: float = 5
+    # After a client's own write, its reads stay on the primary this long (should exceed replication lag)
+    read_your_writes_seconds: float = 5
+    
+    # Authenticated user lookups are cached per worker for this long (size 0 disables the cache)
+    user_cache_size: int = 10000
+    user_cache_ttl_seconds: float = 60
+    # Trust the signed access token for the user id and skip the users lookup where only the id is needed
+    auth_stateless: bool = False
+    # Verified access tokens are cached per worker until they expire, at most this long, so a token presented
+    # again skips the signature check (size 0 disables the cache)
+    access_token_cache_size: int = 10000
+    access_token_cache_ttl_seconds: float = 300
+    # Asymmetric ALGORITHM (RS256, ES256, EdDSA, ...): PEM private key that signs access tokens and its kid, plus the
+    # public keys of retired signing keys as comma-separated kid=path (see keyring.py). HS* algorithms use SECRET_KEY.
+    jwt_private_key_file: str = ""
+    jwt_key_id: str = ""
+    jwt_verification_keys: str = ""
+    
+    # Fall back to trigram title matching when full-text search finds nothing
+    search_trigram_fallback: bool = True
+    
+    # Encoder behind the default response class: "orjson", "msgspec" (needs msgspec installed) or "stdlib"
+    json_response_backend: str = "orjson"
+    # Serve GET /posts/ and GET /posts/{id} from projected rows encoded directly with orjson,
+    # instead of ORM objects validated through the Pydantic schemas
+    post_projection_reads: bool = True
+    # Per-route overrides of post_projection_reads for GET /posts/, /posts/trending and /posts/{id} (unset follows it)
+    post_projection_reads_feed: bool | None = None
+    post_projection_reads_trending: bool | None = None
+    post_projection_reads_detail: bool | None = None
+    
+    # Cache for GET /posts/ and GET /posts/{id} responses: "memory" (per worker), "redis" (shared) or "none"
+    response_cache_backend: str = "memory"
+    response_cache_url: str = "redis://localhost:6379/0"
+    response_cache_ttl_seconds: float = 5
+    response_cache_size: int = 1024
+    
+    # Argon2 cost parameters. Changing them rehashes each user's password on their next login.
+    argon2_time_cost: int = 3
+    argon2_memory_cost: int = 65536  # KiB
+    argon2_parallelism: int = 4
+    # Processes used for hashing/verifying passwords (0 hashes on the threadpool instead)
+    password_hash_workers: int = 2
+    # Hashing requests allowed in flight per worker before new ones get a 503
+    password_hash_max_pending: int = 32
+    
+    # Log statements slower than this with their normalized SQL (0 disables the log)
+    slow_query_threshold_ms: float = 500
+    # Add a Server-Timing header (db time and query count, pool wait, total) to every response
+    server_timing: bool = True
+    
+    # A rotated refresh token presented again within this window is treated as a client race (401) rather than
+    # token theft (401 and the whole token family revoked)
+    refresh_token_reuse_grace_seconds: float = 10
+    
+    # Background purge of expired/revoked refresh tokens in each worker (0 disables it; use the maintenance command instead)
+    refresh_token_purge_interval_seconds: float = 3600
+    refresh_token_purge_batch_size: int = 5000
+    # Revoked refresh tokens are kept this long after being revoked, so reuse of a rotated token is still detected
+    refresh_token_revoked_retention_days: float = 1
+    
+    # GET /posts/trending: a post needs 10x the votes of one this much younger to rank alongside it; posts
+    # older than the window drop out; the background refresh (0 disables it) prunes and repairs the scores
+    trending_decay_seconds: float = 45000
+    trending_window_days: float = 7
+    trending_refresh_interval_seconds: float = 300
+    
+    # Queue single votes and write them in batches every interval or once max_size are waiting (see vote_buffer.py)
+    vote_batch_writes: bool = False
+    vote_batch_interval_ms: float = 20
+    vote_batch_max_size: int = 500
+    
+    # /posts/{id}/live: changed posts are sent to subscribers once per tick; every poll interval all subscribed
+    # posts are re-read to catch changes made through other workers (0 disables it, fine with a single worker)
+    live_tick_ms: float = 250
+    live_poll_seconds: float = 2
+    
+    # Rows fetched per round trip from the server-side cursor of GET /posts/export and /vote/export
+    export_batch_size: int = 1000
+    
+    # python -m app.serve: worker processes (0 = one per CPU available to the container),
+    # listen backlog, idle keep-alive, max concurrent connections per worker (0 = unlimited, above it
+    # new connections get a 503), and how long SIGTERM waits for in-flight requests
+    server_host: str = "0.0.0.0"
+    server_port: int = 8000
+    server_workers: int = 0
+    server_backlog: int = 2048
+    server_keep_alive_seconds: int = 5
+    server_limit_concurrency: int = 0
+    server_graceful_shutdown_seconds: int = 30
     
     class Config:
         env_file = ".env"
 
-# Instantiate settings to access environment variables
-settings = Settings() 
\ No newline at end of file
+@cache
+def get_settings() -> Settings:
+    return Settings()
+
+class _LazySettings:
+    """Reads the environment on first use instead of at import, so modules can be imported without it."""
+
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
+
+# Access environment variables through settings.<name>
+settings = _LazySettings()
@@ -1,22 +1,241 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import logging
+import threading
+import time
+from sqlalchemy import create_engine, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from starlette.concurrency import run_in_threadpool
 from .config import settings
+from . import instrumentation, metrics
 
-# Establish a connection with db. This engine also manages pool of db connections
-engine = create_engine(f"postgresql+psycopg://{settings.database_username}:{settings.database_password}@{settings.database_hostname}/{settings.database_name}", echo=False)
+logger = logging.getLogger(__name__)
 
-# It creates a session factory bound to the engine. 
-# That factory will generate new Session objects when called.
-#now, autoflush (making pending ORM changes to DB) will be called only when we call commit()
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine) 
+def database_url(hostname: str) -> str:
+    return f"postgresql+psycopg://{settings.database_username}:{settings.database_password}@{hostname}/{settings.database_name}"
+
+# Pool wait/checkout metrics, exported at GET /metrics
+pool_wait_seconds = metrics.Histogram("db_pool_wait_seconds", "Time spent waiting for a pooled connection", ("engine",))
+pool_timeouts_total = metrics.Counter("db_pool_timeouts_total", "Checkouts that gave up after pool_timeout", ("engine",))
+
+class _TimedPoolMixin:
+    # Name reported in the `engine` label of the pool metrics
+    metrics_name = "primary"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_timeouts_total.inc(engine=self.metrics_name)
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            pool_wait_seconds.observe(waited, engine=self.metrics_name)
+            instrumentation.record_pool_wait(waited)
+
+    def recreate(self):
+        # Keep a per-engine name (see replicas.py) when the engine replaces its pool
+        pool = super().recreate()
+        pool.metrics_name = self.metrics_name
+        return pool
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    metrics_name = "async"
+
+def engine_options(is_async: bool = False) -> dict:
+    """Keyword arguments for create_engine/create_async_engine built from the pool settings."""
+    connect_args = {}
+    if settings.database_statement_timeout_ms:
+        # Sent as a startup parameter. Behind PgBouncer add `options` to ignore_startup_parameters
+        # or set statement_timeout on the database role instead.
+        connect_args["options"] = f"-c statement_timeout={settings.database_statement_timeout_ms}"
+
+    if settings.database_external_pooler:
+        # The external pooler owns the connections; prepared statements don't survive transaction pooling
+        connect_args["prepare_threshold"] = None
+        return {"poolclass": NullPool, "connect_args": connect_args}
+
+    return {
+        "poolclass": TimedAsyncQueuePool if is_async else TimedQueuePool,
+        "pool_size": settings.database_pool_size,
+        "max_overflow": settings.database_max_overflow,
+        "pool_timeout": settings.database_pool_timeout,
+        "pool_recycle": settings.database_pool_recycle,
+        "pool_pre_ping": settings.database_pool_pre_ping,
+        "connect_args": connect_args,
+    }
+
+# The engines and session factories below are built on first use by init_engines(), so importing
+# this module (models, Alembic, maintenance commands) needs neither the settings nor the driver.
+# Outside this module, database.engine, database.SessionLocal, ... build them on access (see __getattr__).
+_init_lock = threading.Lock()
+_initialized = False
+
+def init_engines():
+    """Builds the primary engine(s) and session factories once; later calls return immediately."""
+    global SQLALCHEMY_DATABASE_URL, engine, SessionLocal, async_engine, AsyncSessionLocal, _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        SQLALCHEMY_DATABASE_URL = database_url(settings.database_hostname)
+
+        # Establish a connection with db. This engine also manages pool of db connections
+        engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=False, **engine_options())
+
+        # It creates a session factory bound to the engine. 
+        # That factory will generate new Session objects when called.
+        #now, autoflush (making pending ORM changes to DB) will be called only when we call commit()
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine) 
+        instrumentation.instrument_engine(engine)
+
+        # Async engine, only built when DATABASE_ASYNC is enabled. psycopg 3 ships its own asyncio driver.
+        # expire_on_commit=False so returned objects can still be read after commit without another round trip.
+        async_engine = create_async_engine(SQLALCHEMY_DATABASE_URL, echo=False, **engine_options(is_async=True)) if settings.database_async else None
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False) if settings.database_async else None
+        if async_engine is not None:
+            instrumentation.instrument_engine(async_engine.sync_engine)
+
+        pooled_engines.update(primary=engine, **{"async": async_engine})
+        engines.extend(candidate for candidate in (engine, async_engine) if candidate is not None)
+        _initialized = True
+
+async def dispose_engines():
+    """Closes the pooled connections of every engine built in this process (called on app shutdown)."""
+    for candidate in engines:
+        if isinstance(candidate, AsyncEngine):
+            await candidate.dispose()
+        else:
+            await run_in_threadpool(candidate.dispose)
+
+_LAZY_ATTRIBUTES = {"SQLALCHEMY_DATABASE_URL", "engine", "SessionLocal", "async_engine", "AsyncSessionLocal"}
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        init_engines()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Engines reported by the pool gauges, by `engine` label (replicas.py adds the replica engines)
+pooled_engines = {}
+# Every engine (sync or async) built in this process, primary and replicas, for dispose_engines()
+engines = []
+
+def _pool_gauge(read):
+    def collect():
+        return {(name,): read(e.pool) for name, e in pooled_engines.items() if e is not None and isinstance(e.pool, QueuePool)}
+    return collect
+
+# Current pool occupancy, read at scrape time (NullPool has nothing to report)
+metrics.Gauge("db_pool_size", "Configured pool size", _pool_gauge(lambda pool: pool.size()), ("engine",))
+metrics.Gauge("db_pool_checked_out", "Connections currently checked out", _pool_gauge(lambda pool: pool.checkedout()), ("engine",))
+metrics.Gauge("db_pool_checked_in", "Idle connections held by the pool", _pool_gauge(lambda pool: pool.checkedin()), ("engine",))
+metrics.Gauge("db_pool_overflow", "Connections opened beyond pool_size", _pool_gauge(lambda pool: pool.overflow()), ("engine",))
+
+# What route handlers receive from get_db, depending on DATABASE_ASYNC
+DbSession = Session | AsyncSession
 
 # This function is a FastAPI dependency that provides a database session to path operations then guarantees the session is closed after the request is done.
-def get_db():
+# It yields an AsyncSession bound to the async engine or a blocking Session depending on DATABASE_ASYNC, so both paths
+# can be A/B tested. The setting is read per request, not when the routers declaring the dependency are imported.
+async def get_db():
+    init_engines()
+    if settings.database_async:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
     db = SessionLocal() # Create a new session
     try:
         yield db # Yield the session to be used in the request
     finally:
-        db.close() # Ensure the session is closed after the request
+        # Ensure the session is closed after the request. Closing returns the connection to the pool
+        # (a ROLLBACK round trip), so it runs on the threadpool rather than on the event loop
+        await run_in_threadpool(db.close)
+
+async def run_db(db: DbSession, fn, *args, **kwargs):
+    """
+    Runs fn(session, *args, **kwargs), where fn is plain synchronous ORM code.
+    With an AsyncSession it runs via run_sync on the event loop (the async driver does the IO),
+    otherwise it runs on the threadpool like a regular `def` path operation would.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+async def run_in_session(fn, *args, **kwargs):
+    """Like run_db, for work outside a request (background tasks): runs fn on a new session of its own."""
+    init_engines()
+    if settings.database_async:
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(_run_in_sync_session, fn, *args, **kwargs)
+
+def _run_in_sync_session(fn, *args, **kwargs):
+    db = SessionLocal()
+    try:
+        return fn(db, *args, **kwargs)
+    finally:
+        db.close()
+
+async def release_db(db: DbSession):
+    """Ends the session's transaction and returns its connection to the pool; the session stays usable."""
+    if isinstance(db, AsyncSession):
+        await db.close()
+    elif db.in_transaction():
+        await run_in_threadpool(db.close)
+
+async def stream_db(db: DbSession, statement, batch_size: int):
+    """
+    Yields the result rows of statement in lists of up to batch_size, read through a server-side
+    cursor so memory stays flat however many rows match. With a sync Session each batch is fetched
+    on the threadpool.
+    """
+    statement = statement.execution_options(yield_per=batch_size)
+    if isinstance(db, AsyncSession):
+        result = await db.stream(statement)
+        try:
+            async for rows in result.partitions():
+                yield rows
+        finally:
+            await result.close()
+        return
+
+    result = await run_in_threadpool(db.execute, statement)
+    partitions = result.partitions()
+    try:
+        while rows := await run_in_threadpool(next, partitions, None):
+            yield rows
+    finally:
+        await run_in_threadpool(result.close)
+
+async def prewarm_pool():
+    """
+    Opens pool_size connections up front so the first requests of a fresh worker don't pay for
+    connection setup. Best effort: if the database is unreachable the pool connects lazily as before.
+    """
+    init_engines()
+    if settings.database_external_pooler or settings.database_pool_size <= 0:
+        return
+    try:
+        if async_engine is not None:
+            connections = [await async_engine.connect() for _ in range(settings.database_pool_size)]
+            for connection in connections:
+                await connection.close()
+        else:
+            await run_in_threadpool(_prewarm_sync_pool)
+    except exc.SQLAlchemyError as error:
+        logger.warning("Could not pre-warm the database pool: %s", error)
+
+def _prewarm_sync_pool():
+    # Hold them all at once, otherwise the pool keeps handing back the same connection
+    connections = [engine.connect() for _ in range(settings.database_pool_size)]
+    for connection in connections:
+        connection.close()
 
 # Define the Base class for declarative models 
 Base = declarative_base()
@@ -0,0 +1,133 @@
+"""
+Per-request SQL instrumentation.
+
+Engine hooks count statements and time spent in the database, the pool records how long checkouts
+waited, and QueryStatsMiddleware attributes both to the request being served: they are returned in a
+Server-Timing header and recorded in per-route histograms exported at GET /metrics. Statements slower
+than SLOW_QUERY_THRESHOLD_MS are logged with their normalized SQL, inside or outside a request.
+"""
+import logging
+import re
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from sqlalchemy import event
+from .config import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+request_duration_seconds = metrics.Histogram("http_request_duration_seconds", "Time to serve a request", ("method", "route"))
+request_db_queries = metrics.Histogram("http_request_db_queries", "SQL statements executed per request", ("method", "route"), QUERY_COUNT_BUCKETS)
+request_db_seconds = metrics.Histogram("http_request_db_seconds", "Time spent executing SQL per request", ("method", "route"))
+request_pool_wait_seconds = metrics.Histogram("http_request_db_pool_wait_seconds", "Time spent waiting for pooled connections per request", ("method", "route"))
+slow_queries_total = metrics.Counter("db_slow_queries_total", "Statements slower than SLOW_QUERY_THRESHOLD_MS", ("route",))
+
+
+@dataclass
+class RequestStats:
+    scope: dict
+    queries: int = 0
+    db_seconds: float = 0.0
+    pool_wait_seconds: float = 0.0
+
+    @property
+    def route(self) -> str:
+        # The router stores the matched route in the (shared) ASGI scope before calling the endpoint
+        route = self.scope.get("route")
+        return getattr(route, "path", "unmatched")
+
+
+# Stats of the request being served. The object is shared (not copied) with threadpool workers,
+# so statements run through run_in_threadpool are counted too.
+_current: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+_LITERALS = re.compile(r"%\(\w+\)s|%s|\$\d+|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_VALUE_LISTS = re.compile(r"\(\?(?:\s*,\s*\?)+\)")
+
+
+def normalize_sql(statement: str) -> str:
+    """Replaces parameters and literals with ? and collapses whitespace, so similar statements group together."""
+    statement = _LITERALS.sub("?", " ".join(statement.split()))
+    return _VALUE_LISTS.sub("(?, ...)", statement)
+
+
+def record_pool_wait(seconds: float):
+    stats = _current.get()
+    if stats is not None:
+        stats.pool_wait_seconds += seconds
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+    threshold = settings.slow_query_threshold_ms / 1000
+    if threshold and elapsed >= threshold:
+        route = stats.route if stats is not None else "none"
+        slow_queries_total.inc(route=route)
+        logger.warning("Slow query (%.1f ms) in %s: %s", elapsed * 1000, route, normalize_sql(statement))
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute is not called for failed statements
+    started = exception_context.connection.info.get("query_started") if exception_context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine):
+    """Attach the statement hooks to a sync Engine (pass async_engine.sync_engine for an AsyncEngine)."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def _server_timing(stats: RequestStats, elapsed: float) -> bytes:
+    return (
+        f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.queries} queries", '
+        f"pool;dur={stats.pool_wait_seconds * 1000:.2f}, "
+        f"app;dur={elapsed * 1000:.2f}"
+    ).encode("latin-1")
+
+
+class QueryStatsMiddleware:
+    """Pure ASGI middleware (no extra task per request) that collects RequestStats for each HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start" and settings.server_timing:
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", _server_timing(stats, time.perf_counter() - started)))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            route = stats.route
+            method = scope["method"]
+            request_duration_seconds.observe(time.perf_counter() - started, method=method, route=route)
+            request_db_queries.observe(stats.queries, method=method, route=route)
+            request_db_seconds.observe(stats.db_seconds, method=method, route=route)
+            request_pool_wait_seconds.observe(stats.pool_wait_seconds, method=method, route=route)
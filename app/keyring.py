@@ -0,0 +1,73 @@
+"""
+Access token keys.
+
+With an HS* ALGORITHM, access tokens are signed and verified with SECRET_KEY, as before. With an
+asymmetric one (RS256, PS256, ES256, EdDSA, ...), they are signed with the private key in
+JWT_PRIVATE_KEY_FILE, and their header names the key in `kid` (JWT_KEY_ID). Other services verify
+them locally with the public keys published at GET /auth/jwks.json and never need the private key or
+a call to this API.
+
+Key rotation: deploy the new key as JWT_PRIVATE_KEY_FILE/JWT_KEY_ID and list the previous public key
+in JWT_VERIFICATION_KEYS (kid=path, comma-separated). Once ACCESS_TOKEN_EXPIRE_MINUTES has passed,
+no valid token is signed with the old key any more and it can be removed. Tokens are verified with
+the key their kid names, and only with ALGORITHM: changing ALGORITHM rejects earlier access tokens,
+so clients use their refresh token to get new ones.
+"""
+from functools import cache
+from pathlib import Path
+import jwt
+from .config import settings
+
+
+class Keyring:
+    """The key that signs access tokens, and every key they may be verified with, by kid."""
+
+    def __init__(self, algorithm: str, signing_key, kid: str | None = None, verification_keys: dict | None = None):
+        self.algorithm = algorithm
+        self.kid = kid
+        self._algorithm = jwt.get_algorithm_by_name(algorithm)
+        self.symmetric = isinstance(self._algorithm, jwt.algorithms.HMACAlgorithm)
+        # Keys are parsed once here: PyJWT would parse a PEM string again on every call
+        self._signing_key = self._algorithm.prepare_key(signing_key)
+        self.verification_keys = {key_id: self._algorithm.prepare_key(key) for key_id, key in (verification_keys or {}).items()}
+        self.verification_keys[kid] = self._signing_key if self.symmetric else self._signing_key.public_key()
+
+    def sign(self, payload: dict) -> str:
+        return jwt.encode(payload, self._signing_key, algorithm=self.algorithm, headers={"kid": self.kid} if self.kid else None)
+
+    def decode(self, token: str) -> dict:
+        """The verified claims of the token. Raises jwt.PyJWTError if it is invalid or expired."""
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = self.verification_keys.get(kid)
+        if key is None:
+            raise jwt.InvalidKeyError(f"Unknown key id {kid!r}")
+        return jwt.decode(token, key, algorithms=[self.algorithm], options={"require": ["exp"]})
+
+    def jwks(self) -> list[dict]:
+        """The public verification keys as JWKs (none for HS* algorithms: the secret is never published)."""
+        if self.symmetric:
+            return []
+        keys = []
+        for kid, key in self.verification_keys.items():
+            jwk = {**self._algorithm.to_jwk(key, as_dict=True), "alg": self.algorithm, "use": "sig"}
+            if kid:
+                jwk["kid"] = kid
+            keys.append(jwk)
+        return keys
+
+
+@cache
+def access_token_keyring() -> Keyring:
+    """The keyring configured by ALGORITHM, SECRET_KEY and the JWT_* settings, built on first use."""
+    if settings.jwt_private_key_file:
+        signing_key = Path(settings.jwt_private_key_file).read_bytes()
+    elif settings.algorithm.startswith("HS"):
+        signing_key = settings.secret_key
+    else:
+        raise ValueError(f"ALGORITHM {settings.algorithm} signs with a private key: set JWT_PRIVATE_KEY_FILE")
+    verification_keys = {}
+    for entry in settings.jwt_verification_keys.split(","):
+        if entry.strip():
+            kid, _, path = entry.partition("=")
+            verification_keys[kid.strip()] = Path(path.strip()).read_bytes()
+    return Keyring(settings.algorithm, signing_key, settings.jwt_key_id or None, verification_keys)
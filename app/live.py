@@ -0,0 +1,121 @@
+"""
+Live post updates for GET/WebSocket /posts/{id}/live.
+
+LiveHub keeps the subscribers of each post in this worker. The vote, update and delete handlers
+publish the ids of the posts they changed; every LIVE_TICK_MS the hub reloads the changed posts that
+have subscribers with one query and sends the new state to each subscriber, so any number of votes
+on a post within a tick becomes one message. Votes handled by other workers are picked up by
+re-reading every subscribed post each LIVE_POLL_SECONDS (again one query per worker, however many
+clients are connected). Nothing is sent when a post's state didn't change.
+
+A subscriber only ever holds the latest state: a slow client skips intermediate states instead of
+building up a backlog.
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from functools import cache
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from . import database, metrics, models
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """The latest state of one post for one client."""
+
+    def __init__(self):
+        self._latest = None
+        self._changed = asyncio.Event()
+
+    def put(self, state: dict):
+        self._latest = state
+        self._changed.set()
+
+    async def get(self) -> dict:
+        await self._changed.wait()
+        self._changed.clear()
+        return self._latest
+
+
+def _load_posts(db: Session, post_ids: list[int]) -> dict[int, dict]:
+    rows = db.execute(
+        select(models.Post.id, models.Post.title, models.Post.content, models.Post.is_published, models.Post.vote_count)
+        .where(models.Post.id.in_(post_ids))
+    ).all()
+    return {
+        row.id: {"post_id": row.id, "title": row.title, "content": row.content, "is_published": row.is_published, "votes": row.vote_count}
+        for row in rows
+    }
+
+
+class LiveHub:
+    def __init__(self, tick: float, poll_interval: float):
+        self.tick = tick
+        self.poll_interval = poll_interval
+        self._subscribers: dict[int, set[Subscription]] = {}
+        self._sent: dict[int, dict] = {}  # last state sent per subscribed post
+        self._changed: set[int] = set()
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+    def publish(self, *post_ids: int):
+        """Marks posts as changed; their subscribers get the new state on the next tick."""
+        self._changed.update(post_id for post_id in post_ids if post_id in self._subscribers)
+
+    async def current(self, post_id: int) -> dict | None:
+        """The post's state as sent to subscribers, or None if it doesn't exist."""
+        return (await database.run_in_session(_load_posts, [post_id])).get(post_id)
+
+    @asynccontextmanager
+    async def subscribe(self, post_id: int, state: dict):
+        """Registers a subscriber for the post, starting from `state` (see current())."""
+        subscription = Subscription()
+        subscription.put(state)
+        self._subscribers.setdefault(post_id, set()).add(subscription)
+        self._sent.setdefault(post_id, state)
+        try:
+            yield subscription
+        finally:
+            subscriptions = self._subscribers[post_id]
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[post_id]
+                self._sent.pop(post_id, None)
+
+    async def run(self):
+        """Sends changed states every tick until cancelled."""
+        last_poll = time.monotonic()
+        while True:
+            await asyncio.sleep(self.tick)
+            post_ids, self._changed = self._changed, set()
+            if self.poll_interval and time.monotonic() - last_poll >= self.poll_interval:
+                post_ids = set(self._subscribers)
+                last_poll = time.monotonic()
+            post_ids &= self._subscribers.keys()
+            if not post_ids:
+                continue
+            try:
+                states = await database.run_in_session(_load_posts, list(post_ids))
+            except Exception:
+                logger.exception("Loading live post states failed")
+                continue
+            for post_id in post_ids:
+                state = states.get(post_id, {"post_id": post_id, "deleted": True})
+                if post_id in self._subscribers and state != self._sent.get(post_id):
+                    self._sent[post_id] = state
+                    for subscription in self._subscribers[post_id]:
+                        subscription.put(state)
+
+
+# Built on first use (the lifespan builds it at startup and runs it)
+@cache
+def get_live_hub() -> LiveHub:
+    return LiveHub(settings.live_tick_ms / 1000, settings.live_poll_seconds)
+
+metrics.Gauge("live_subscribers", "Clients subscribed to live post updates", lambda: get_live_hub().subscriber_count)
@@ -1,7 +1,8 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .database import engine, Base
-from .routers import post, user, auth, vote
+from .config import settings
 
 # Create the database tables if they do not exist yet on startup. Don't use if using Alembic migrations in production.
 # Base.metadata.create_all(bind=engine)
@@ -13,32 +14,109 @@ Production note
 In real production, you usually do not run create_all() on startup.
 You use Alembic migrations instead. But for learning/tutorials, it’s fine.
 """
-app = FastAPI()
+# Startup/shutdown of resources owned by the app
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from . import database, oauth2
+    from .cache import get_response_cache
+    from .maintenance import purge_refresh_tokens_periodically
+    from .replicas import get_replica_router
+    from .routers.vote import get_vote_buffer
+    from .trending import refresh_trending_periodically
+    from .live import get_live_hub
+    from .keyring import access_token_keyring
+    from .utils import shutdown_password_hasher
 
-origins = [
-    "http://localhost",
-    "http://localhost:8080",
-    
-]
+    # Runs before the worker accepts connections: builds the engines and the per-worker resources
+    # (all of them are otherwise built on first use). Loading the token keys here makes a bad key fail the start
+    database.init_engines()
+    replica_router = get_replica_router()
+    if replica_router is not None:
+        # Replicas take reads only once they have passed a check
+        await replica_router.check_health()
+    access_token_keyring()
+    get_response_cache()
+    oauth2.get_user_cache()
+    oauth2.get_verified_token_cache()
+    if settings.database_pool_prewarm:
+        await database.prewarm_pool()
+    vote_buffer = get_vote_buffer()
+    if vote_buffer is not None:
+        vote_buffer.start()
+    tasks = [asyncio.create_task(get_live_hub().run())]
+    if settings.refresh_token_purge_interval_seconds > 0:
+        tasks.append(asyncio.create_task(purge_refresh_tokens_periodically(settings.refresh_token_purge_interval_seconds)))
+    if settings.trending_refresh_interval_seconds > 0:
+        tasks.append(asyncio.create_task(refresh_trending_periodically(settings.trending_refresh_interval_seconds)))
+    if replica_router is not None:
+        tasks.append(asyncio.create_task(replica_router.run_health_checks(settings.database_replica_health_check_seconds)))
+    yield
+    # Requests still waiting on queued votes have been answered by now (uvicorn drains them first)
+    if vote_buffer is not None:
+        await vote_buffer.close()
+    for task in tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    shutdown_password_hasher()
+    await database.dispose_engines()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def create_app() -> FastAPI:
+    """
+    Builds the application. The routers (and through them the ORM, JWT and hashing modules) are
+    imported here rather than at the top, and the engines, connection pools and background tasks
+    are created by the lifespan, so importing app.main stays cheap:
 
-app.include_router(post.router)
-app.include_router(user.router)
-app.include_router(auth.router)
-app.include_router(vote.router)
+        uvicorn app.main:create_app --factory
+    """
+    from .instrumentation import QueryStatsMiddleware
+    from .responses import response_class
+    from .routers import post, user, auth, vote, metrics
+    from .replicas import ReadYourWritesMiddleware, replica_hostnames
 
-# Get Root
-@app.get("/")
-async def root():
-    return {"message": "Hello, World! "}
+    # Every route renders its JSON with the configured encoder unless its router says otherwise
+    app = FastAPI(lifespan=lifespan, default_response_class=response_class(settings.json_response_backend))
 
+    origins = [
+        "http://localhost",
+        "http://localhost:8080",
 
+    ]
 
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        # Browsers only let scripts read these response headers when they are listed
+        expose_headers=["X-Next-Cursor", "ETag"],
+    )
 
+    if replica_hostnames():
+        app.add_middleware(ReadYourWritesMiddleware)
+
+    # Outermost, so the timings cover the whole request
+    app.add_middleware(QueryStatsMiddleware)
+
+    app.include_router(post.router)
+    app.include_router(user.router)
+    app.include_router(auth.router)
+    app.include_router(vote.router)
+    app.include_router(metrics.router)
+
+    # Get Root
+    @app.get("/")
+    async def root():
+        return {"message": "Hello, World! "}
+
+    return app
+
+
+def __getattr__(name):
+    global app
+    # `app.main:app` (uvicorn without --factory, TestClient, the benchmarks) builds the app on first access
+    if name == "app":
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,122 @@
+"""
+Maintenance commands that are run out of band, e.g. from cron or by hand:
+
+    python -m app.maintenance reconcile-votes
+    python -m app.maintenance purge-refresh-tokens
+    python -m app.maintenance refresh-trending
+
+The refresh token purge and the trending refresh also run in the background of every app worker (see main.lifespan).
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from . import database, metrics, models, trending
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+refresh_tokens_purged_total = metrics.Counter("refresh_tokens_purged_total", "Expired or revoked refresh tokens deleted by the purge")
+refresh_token_purge_seconds = metrics.Histogram("refresh_token_purge_seconds", "Duration of a complete refresh token purge")
+
+# Recompute posts.vote_count from the votes table
+def reconcile_vote_counts(db: Session) -> int:
+    """
+    Repairs any drift between the denormalized posts.vote_count and the votes table.
+    Returns the number of posts that were corrected.
+    """
+    actual_votes = select(func.count(models.Vote.post_id)).where(
+        models.Vote.post_id == models.Post.id
+    ).scalar_subquery()
+
+    result = db.execute(
+        update(models.Post.__table__)
+        .where(models.Post.vote_count != actual_votes)
+        .values(vote_count=actual_votes)
+    )
+    db.commit()
+    return result.rowcount
+
+# Delete refresh tokens that can no longer be used
+def purge_refresh_tokens(db: Session, batch_size: int | None = None) -> int:
+    """
+    Deletes expired refresh tokens, and revoked ones once REFRESH_TOKEN_REVOKED_RETENTION_DAYS
+    have passed since they were revoked (until then a reused token is still recognized as revoked).
+    Works in batches of batch_size rows with a commit after each, so row locks are short-lived and
+    rows locked by a concurrent purge (another worker) are skipped. Returns the number of rows deleted.
+    """
+    batch_size = batch_size or settings.refresh_token_purge_batch_size
+    table = models.RefreshToken.__table__
+    now = datetime.now(timezone.utc)
+    # Counted from the revocation, not the issue: a token rotated late in its life must still be
+    # recognized when it is replayed. Range scans on ix_refresh_tokens_expires_at and ix_refresh_tokens_revoked_at
+    revoked_before = now - timedelta(days=settings.refresh_token_revoked_retention_days)
+    batch = select(table.c.id).where(
+        or_(
+            table.c.expires_at <= now,
+            table.c.revoked_at <= revoked_before,
+        )
+    ).limit(batch_size).with_for_update(skip_locked=True)
+
+    started = time.perf_counter()
+    total = 0
+    while True:
+        deleted = db.execute(delete(table).where(table.c.id.in_(batch.scalar_subquery()))).rowcount
+        db.commit()
+        total += deleted
+        refresh_tokens_purged_total.inc(deleted)
+        if deleted < batch_size:
+            break
+    refresh_token_purge_seconds.observe(time.perf_counter() - started)
+    return total
+
+def _purge_refresh_tokens_job() -> int:
+    db = database.SessionLocal()
+    try:
+        return purge_refresh_tokens(db)
+    finally:
+        db.close()
+
+async def purge_refresh_tokens_periodically(interval: float):
+    """Runs the refresh token purge every `interval` seconds until cancelled."""
+    # Workers start together; spread their purges over the interval
+    await asyncio.sleep(random.uniform(0, interval))
+    while True:
+        try:
+            purged = await run_in_threadpool(_purge_refresh_tokens_job)
+            logger.info("Purged %d refresh token(s)", purged)
+        except Exception:
+            logger.exception("Refresh token purge failed")
+        await asyncio.sleep(interval)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m app.maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("reconcile-votes", help="Recompute posts.vote_count from the votes table")
+    commands.add_parser("purge-refresh-tokens", help="Delete expired and revoked refresh tokens")
+    commands.add_parser("refresh-trending", help="Rescore recent posts and drop old ones from the trending table")
+    args = parser.parse_args(argv)
+
+    db = database.SessionLocal()
+    try:
+        if args.command == "reconcile-votes":
+            fixed = reconcile_vote_counts(db)
+            print(f"Reconciled vote counts, {fixed} post(s) corrected")
+        elif args.command == "purge-refresh-tokens":
+            purged = purge_refresh_tokens(db)
+            print(f"Purged {purged} refresh token(s)")
+        elif args.command == "refresh-trending":
+            rescored, dropped = trending.refresh_trending_scores(db)
+            print(f"Refreshed trending scores, {rescored} post(s) rescored, {dropped} dropped")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
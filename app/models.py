@@ -1,8 +1,13 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Text, Boolean, DateTime, text
-from sqlalchemy.orm import relationship
+import uuid
+from sqlalchemy import Column, Computed, Float, ForeignKey, Integer, String, Text, Boolean, DateTime, Index, Uuid, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, relationship
 from .database import Base
 from sqlalchemy.sql import func
 
+# Text search configuration used for posts.search_vector and the queries against it
+SEARCH_CONFIG = "english"
+
 class Post(Base):
     __tablename__ = "posts"
 
@@ -12,8 +17,21 @@ class Post(Base):
     is_published = Column(Boolean, nullable=False, server_default=text("true"))
     created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False) # calling the table name 'users' and its column 'id'
+    vote_count = Column(Integer, nullable=False, server_default=text("0")) # kept in sync by the vote endpoint, repaired by `python -m app.maintenance reconcile-votes`
+    # Generated by Postgres from title + content; deferred so regular reads don't fetch it
+    search_vector = deferred(Column(TSVECTOR, Computed(f"to_tsvector('{SEARCH_CONFIG}', coalesce(title, '') || ' ' || coalesce(content, ''))", persisted=True)))
     owner = relationship("User") #calling the sqlalchemy class User
 
+    __table_args__ = (
+        # Matches the feed ordering so keyset pagination is an index range scan
+        Index("ix_posts_created_at_id", "created_at", "id"),
+        # A user's posts (ON DELETE CASCADE from users, export by owner), in feed order
+        Index("ix_posts_owner_id_created_at", "owner_id", "created_at", "id"),
+        # Full-text search, plus trigram matching on titles for typos/partial words (needs pg_trgm)
+        Index("ix_posts_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_posts_title_trgm", "title", postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"}),
+    )
+
 
 class User(Base):
     __tablename__ = "users"
@@ -29,12 +47,39 @@ class Vote(Base):
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
     post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
 
+    __table_args__ = (
+        # The primary key leads with user_id; votes of a post (ON DELETE CASCADE from posts) need their own index
+        Index("ix_votes_post_id", "post_id"),
+    )
+
+# Trending score of each recent post (see trending.py), kept small so GET /posts/trending is a top-K index scan
+class PostScore(Base):
+    __tablename__ = "post_scores"
+
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
+    score = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_post_scores_score_post_id", score.desc(), post_id.desc()),
+    )
+
 class RefreshToken(Base):
     __tablename__ = "refresh_tokens"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    token = Column(String, unique=True, nullable=False, index=True)
+    # Hex SHA-256 of the token handed to the client; the token itself is never stored
+    token_hash = Column(String(64), unique=True, nullable=False, index=True)
     expires_at = Column(DateTime(timezone=True), nullable=False)
     is_revoked = Column(Boolean, nullable=False, server_default=text("false"))
-    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    revoked_at = Column(DateTime(timezone=True), nullable=True)
+    # Shared by every token rotated from the same login, so a replayed token can revoke the whole chain
+    family_id = Column(Uuid, nullable=False, index=True, default=uuid.uuid4)
+
+    __table_args__ = (
+        # revoke_all_user_tokens, and the background purge of expired/revoked rows
+        Index("ix_refresh_tokens_user_id_is_revoked", "user_id", "is_revoked"),
+        Index("ix_refresh_tokens_expires_at", "expires_at"),
+        Index("ix_refresh_tokens_revoked_at", "revoked_at"),
+    )
\ No newline at end of file
@@ -1,17 +1,48 @@
 from fastapi import Depends, HTTPException, status
+from sqlalchemy import event, select, update
 from sqlalchemy.orm import Session
 import jwt #PyJWT==2.10.1
 from datetime import datetime, timedelta, timezone
+import hashlib
 import secrets
-from . import schemas, database, models
+import time
+import uuid
+from functools import cache
+from . import schemas, database, metrics, models
 from fastapi.security.oauth2 import OAuth2PasswordBearer
 from .config import settings
+from .cache import TTLCache
+from .keyring import access_token_keyring
 oauth2_scheme =  OAuth2PasswordBearer(tokenUrl="auth/login")
 
-SECRET_KEY = settings.secret_key
-ALGORITHM = settings.algorithm
-ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
-REFRESH_TOKEN_EXPIRE_DAYS = settings.refresh_token_expire_days
+# Snapshots (schemas.UserResponse) of authenticated users keyed by id, so get_current_user
+# doesn't need a users query on every request. Built on first use (the lifespan builds it at startup)
+@cache
+def get_user_cache() -> TTLCache:
+    return TTLCache(maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl_seconds)
+
+# Claims (schemas.TokenData) of access tokens whose signature was already checked, keyed by the
+# SHA-256 digest of the token and kept until the token expires (see verify_access_token)
+@cache
+def get_verified_token_cache() -> TTLCache:
+    return TTLCache(maxsize=settings.access_token_cache_size, ttl=settings.access_token_cache_ttl_seconds)
+
+access_token_verifications_total = metrics.Counter(
+    "access_token_verifications_total", "Access tokens checked, by result (cached, verified, rejected)", ("result",)
+)
+
+# Replayed refresh tokens that got their family revoked (see rotate_refresh_token)
+refresh_token_families_revoked_total = metrics.Counter("refresh_token_families_revoked_total", "Refresh token families revoked after a rotated token was reused")
+
+def invalidate_cached_user(user_id: int):
+    """Drop a user from this worker's cache. Call whenever the user row changes."""
+    get_user_cache().delete(user_id)
+
+# Keep the cache honest for any change made through the ORM in this process
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_user_on_change(mapper, connection, target):
+    invalidate_cached_user(target.id)
 
 # Create a JWT ACCESS token
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
@@ -19,41 +50,101 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
     else:
-        expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = datetime.now(timezone.utc) + timedelta(minutes=settings.access_token_expire_minutes)
     
     to_encode.update({
         "exp": expire,
         "type": "access"  # IMPORTANT: Mark as access token
     })
 
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = access_token_keyring().sign(to_encode)
     return encoded_jwt
 
-# CREATE a REFRESH token (long-lived, stored in DB)
-def create_refresh_token(user_id: int, db: Session):
+def hash_refresh_token(token: str) -> str:
     """
-    Creates a refresh token and stores it in the database.
-    Returns the token string.
+    The value stored in refresh_tokens.token_hash. Tokens are 256 random bits, so a plain
+    SHA-256 is enough: a leaked table can't be turned back into usable tokens.
     """
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _add_refresh_token(user_id: int, db: Session, family_id: uuid.UUID | None = None) -> str:
     # Generate a cryptographically secure random token
     token = secrets.token_urlsafe(32)
     
     # Calculate expiration (30 days from now)
-    expires_at = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    expires_at = datetime.now(timezone.utc) + timedelta(days=settings.refresh_token_expire_days)
     
-    # Create database record
-    db_token = models.RefreshToken(
+    # Create database record (a new family unless this token is rotated from an existing one)
+    db.add(models.RefreshToken(
         user_id=user_id,
-        token=token,
-        expires_at=expires_at
-    )
-    
-    db.add(db_token)
+        token_hash=hash_refresh_token(token),
+        expires_at=expires_at,
+        family_id=family_id or uuid.uuid4()
+    ))
+    return token
+
+# CREATE a REFRESH token (long-lived, stored in DB)
+def create_refresh_token(user_id: int, db: Session):
+    """
+    Creates a refresh token and stores its hash in the database.
+    Returns the token string.
+    """
+    token = _add_refresh_token(user_id, db)
     db.commit()
-    db.refresh(db_token)
     
     return token
 
+# ROTATE a REFRESH token (for /auth/refresh)
+def rotate_refresh_token(token: str, db: Session):
+    """
+    Revokes a valid refresh token and issues its successor in one transaction:
+    UPDATE ... RETURNING claims the old token atomically, so of two concurrent
+    rotations of the same token only one succeeds.
+    Returns (user_id, new token), or None if the token is invalid, revoked or expired.
+
+    Presenting a token that was rotated more than REFRESH_TOKEN_REUSE_GRACE_SECONDS ago
+    means it was copied: every token of its family is revoked (the thief and the
+    legitimate client both have to log in again).
+    """
+    now = datetime.now(timezone.utc)
+    token_hash = hash_refresh_token(token)
+    claimed = db.execute(
+        update(models.RefreshToken)
+        .where(
+            models.RefreshToken.token_hash == token_hash,
+            models.RefreshToken.is_revoked == False,
+            models.RefreshToken.expires_at > now
+        )
+        .values(is_revoked=True, revoked_at=now)
+        .returning(models.RefreshToken.user_id, models.RefreshToken.family_id)
+        .execution_options(synchronize_session=False)
+    ).first()
+
+    if claimed is not None:
+        new_token = _add_refresh_token(claimed.user_id, db, family_id=claimed.family_id)
+        db.commit()
+        return claimed.user_id, new_token
+
+    # Revoked within the grace period is a client racing itself (parallel refreshes on app resume), not reuse
+    reused_family = select(models.RefreshToken.family_id).where(
+        models.RefreshToken.token_hash == token_hash,
+        models.RefreshToken.is_revoked == True,
+        models.RefreshToken.revoked_at < now - timedelta(seconds=settings.refresh_token_reuse_grace_seconds)
+    ).scalar_subquery()
+    revoked = db.execute(
+        update(models.RefreshToken)
+        .where(
+            models.RefreshToken.family_id == reused_family,
+            models.RefreshToken.is_revoked == False
+        )
+        .values(is_revoked=True, revoked_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    if revoked:
+        refresh_token_families_revoked_total.inc()
+    return None
+
 # VERIFY a REFRESH token
 def verify_refresh_token(token: str, db: Session):
     """
@@ -64,7 +155,7 @@ def verify_refresh_token(token: str, db: Session):
     Returns user_id if valid, None otherwise.
     """
     db_token = db.query(models.RefreshToken).filter(
-        models.RefreshToken.token == token,
+        models.RefreshToken.token_hash == hash_refresh_token(token),
         models.RefreshToken.is_revoked == False,
         models.RefreshToken.expires_at > datetime.now(timezone.utc)
     ).first()
@@ -81,7 +172,7 @@ def revoke_refresh_token(token: str, db: Session):
     Only finds tokens that are NOT already revoked.
     """
     db_token = db.query(models.RefreshToken).filter(
-        models.RefreshToken.token == token,
+        models.RefreshToken.token_hash == hash_refresh_token(token),
         models.RefreshToken.is_revoked == False  # ← Only find non-revoked tokens
     ).first()
     
@@ -90,6 +181,7 @@ def revoke_refresh_token(token: str, db: Session):
     
     # Token exists and is not revoked
     db_token.is_revoked = True
+    db_token.revoked_at = datetime.now(timezone.utc)
     db.commit()
     return True
 
@@ -102,14 +194,22 @@ def revoke_all_user_tokens(user_id: int, db: Session):
     db.query(models.RefreshToken).filter(
         models.RefreshToken.user_id == user_id,
         models.RefreshToken.is_revoked == False
-    ).update({"is_revoked": True})
+    ).update({"is_revoked": True, "revoked_at": datetime.now(timezone.utc)})
     db.commit()
+    invalidate_cached_user(user_id)
 
 # Verify and decode a JWT token
 def verify_access_token(token: str, credentials_exception):
+    # A token seen before skips the signature check until it expires
+    digest = hashlib.sha256(token.encode()).digest()
+    token_data = get_verified_token_cache().get(digest)
+    if token_data is not None:
+        access_token_verifications_total.inc(result="cached")
+        return token_data
+
     try:
         # Decode the JWT token and extract the payload
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = access_token_keyring().decode(token)
         # print(payload)
         user_id = payload.get("user_id")
         token_type = payload.get("type")
@@ -123,19 +223,42 @@ def verify_access_token(token: str, credentials_exception):
         
         token_data = schemas.TokenData(id=int(user_id), type=token_type)
         
-    except jwt.PyJWTError:
+    except (jwt.PyJWTError, HTTPException):
+        access_token_verifications_total.inc(result="rejected")
         raise credentials_exception
+    access_token_verifications_total.inc(result="verified")
+    verified_token_cache = get_verified_token_cache()
+    verified_token_cache.set(digest, token_data, ttl=min(payload["exp"] - time.time(), verified_token_cache.ttl))
     return token_data
 
-# Dependency to get the current user based on the token
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
-    credentials_exception = HTTPException(
+def _get_user_by_id(db: Session, user_id: int):
+    return db.query(models.User).filter(models.User.id == user_id).first()
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+# Dependency to get the current user based on the token
+async def get_current_user(token: str = Depends(oauth2_scheme), db: database.DbSession = Depends(database.get_db)):
+    credentials_exception = _credentials_exception()
     token_data = verify_access_token(token, credentials_exception)
-    user = db.query(models.User).filter(models.User.id == token_data.id).first()
+
+    user_cache = get_user_cache()
+    user = user_cache.get(token_data.id)
     if user is None:
-        raise credentials_exception
-    return user 
\ No newline at end of file
+        db_user = await database.run_db(db, _get_user_by_id, token_data.id)
+        if db_user is None:
+            raise credentials_exception
+        user = schemas.UserResponse.model_validate(db_user)
+        user_cache.set(user.id, user)
+    return user
+
+# Dependency for handlers that only need current_user.id. With AUTH_STATELESS the id comes straight
+# from the signed token and the database is never touched; otherwise it behaves like get_current_user.
+async def get_current_identity(token: str = Depends(oauth2_scheme), db: database.DbSession = Depends(database.get_db)):
+    if settings.auth_stateless:
+        return verify_access_token(token, _credentials_exception())
+    return await get_current_user(token, db)
@@ -0,0 +1,211 @@
+"""
+Read replica routing.
+
+With DATABASE_REPLICA_HOSTNAMES set, read-only routes take their session from get_read_db, which
+hands out replica sessions round-robin. Replicas are only used once they have passed a health check
+(the lifespan runs one before the worker serves requests). A replica that fails the periodic check,
+refuses a connection or drops one during a request is skipped until a later check succeeds; a
+request whose replica can't be connected to reads from the primary instead, and with no healthy
+replica all reads go to the primary. Writes always use get_db (the primary).
+
+Read-your-writes: ReadYourWritesMiddleware answers every successful write with a short-lived cookie,
+and requests carrying it read from the primary for READ_YOUR_WRITES_SECONDS, so clients see their
+own changes despite replication lag. Being a cookie, it works across workers and containers.
+"""
+import asyncio
+import itertools
+import logging
+import math
+import threading
+import time
+from fastapi import Request
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
+from . import database, instrumentation, metrics
+from .database import DbSession
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_COOKIE = "read_primary_until"
+
+read_routing_total = metrics.Counter("db_read_routing_total", "Sessions handed out by get_read_db, by target", ("target",))
+
+
+class Replica:
+    """Engine and session factory for one replica, of the same kind (sync/async) as the primary's."""
+
+    def __init__(self, name: str, hostname: str):
+        self.name = name
+        # None until the first health check: reads only go to replicas known to be up
+        self.healthy: bool | None = None
+        url = database.database_url(hostname)
+        if settings.database_async:
+            self.engine = create_async_engine(url, echo=False, **database.engine_options(is_async=True))
+            self.sessionmaker = async_sessionmaker(self.engine, autoflush=False, expire_on_commit=False)
+            sync_engine = self.engine.sync_engine
+        else:
+            self.engine = create_engine(url, echo=False, **database.engine_options())
+            self.sessionmaker = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+            sync_engine = self.engine
+        sync_engine.pool.metrics_name = name
+        instrumentation.instrument_engine(sync_engine)
+        database.pooled_engines[name] = sync_engine
+        database.engines.append(self.engine)
+
+    async def check(self):
+        try:
+            if isinstance(self.engine, AsyncEngine):
+                async with self.engine.connect() as connection:
+                    await asyncio.wait_for(connection.execute(text("SELECT 1")), settings.database_replica_health_check_seconds)
+            else:
+                await asyncio.wait_for(run_in_threadpool(self._check_sync), settings.database_replica_health_check_seconds)
+        except (exc.SQLAlchemyError, OSError, asyncio.TimeoutError) as error:
+            if self.healthy is not False:
+                logger.warning("Replica %s failed its health check, reading from the others: %s", self.name, error)
+            self.healthy = False
+        else:
+            if self.healthy is False:
+                logger.warning("Replica %s is healthy again", self.name)
+            self.healthy = True
+
+    def _check_sync(self):
+        with self.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+
+
+class ReplicaRouter:
+    def __init__(self, hostnames: list[str]):
+        self.replicas = [Replica(f"replica{index}", hostname) for index, hostname in enumerate(hostnames, 1)]
+        self._turn = itertools.count()
+
+    def pick(self) -> Replica | None:
+        """The next healthy replica in round-robin order, or None if there is none."""
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+    async def check_health(self):
+        await asyncio.gather(*(replica.check() for replica in self.replicas))
+
+    async def run_health_checks(self, interval: float):
+        """Re-checks every replica every `interval` seconds until cancelled (the lifespan runs the first check)."""
+        while True:
+            await asyncio.sleep(interval)
+            await self.check_health()
+
+
+def replica_hostnames() -> list[str]:
+    return [hostname.strip() for hostname in settings.database_replica_hostnames.split(",") if hostname.strip()]
+
+# Like the primary engines (database.init_engines), the replica engines are built on first use: the
+# lifespan builds them at startup, so importing this module or building the app connects to nothing
+_router_lock = threading.Lock()
+_replica_router = None
+_router_initialized = False
+
+def get_replica_router() -> ReplicaRouter | None:
+    """The replica router, or None without DATABASE_REPLICA_HOSTNAMES."""
+    global _replica_router, _router_initialized
+    if _router_initialized:
+        return _replica_router
+    with _router_lock:
+        if not _router_initialized:
+            hostnames = replica_hostnames()
+            _replica_router = ReplicaRouter(hostnames) if hostnames else None
+            _router_initialized = True
+    return _replica_router
+
+metrics.Gauge(
+    "db_replica_healthy", "1 while the replica passes its health checks",
+    lambda: {(replica.name,): int(bool(replica.healthy)) for replica in _replica_router.replicas} if _replica_router else {},
+    ("replica",),
+)
+
+
+def reads_from_primary(request: Request) -> bool:
+    """True while the client is inside the read-your-writes window of its last write."""
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def _route(request: Request) -> Replica | None:
+    replica_router = get_replica_router()
+    if replica_router is not None and not reads_from_primary(request):
+        return replica_router.pick()
+    return None
+
+
+async def _close(db: DbSession):
+    if isinstance(db, AsyncSession):
+        await db.close()
+    else:
+        await run_in_threadpool(db.close)
+
+
+async def _connect(replica: Replica) -> DbSession | None:
+    """
+    A session on the replica with its connection already checked out, or None (and the replica
+    marked unhealthy) if it can't be connected to. Checking out up front, rather than on the first
+    statement, is what lets the request still be served from the primary.
+    """
+    db = replica.sessionmaker()
+    try:
+        if isinstance(db, AsyncSession):
+            await db.connection()
+        else:
+            await run_in_threadpool(db.connection)
+    except exc.DBAPIError as error:
+        if replica.healthy:
+            logger.warning("Replica %s refused a connection, reading from the others: %s", replica.name, error)
+        replica.healthy = False
+        await _close(db)
+        return None
+    return db
+
+
+def _mark_unhealthy(replica: Replica | None, error: Exception):
+    # Lost/refused connection: stop routing to it until the next successful health check
+    if replica is not None and isinstance(error, exc.OperationalError):
+        replica.healthy = False
+
+# The dependency for read-only routes: like database.get_db, but with a replica session when one can serve the request
+async def get_read_db(request: Request):
+    replica = _route(request)
+    db = await _connect(replica) if replica else None
+    if db is None:
+        replica = None
+        db = database.AsyncSessionLocal() if settings.database_async else database.SessionLocal()
+    read_routing_total.inc(target=replica.name if replica else "primary")
+    try:
+        yield db
+    except exc.DBAPIError as error:
+        _mark_unhealthy(replica, error)
+        raise
+    finally:
+        await _close(db)
+
+
+class ReadYourWritesMiddleware:
+    """Sets the read-your-writes cookie on every successful non-GET response."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS"):
+            return await self.app(scope, receive, send)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                seconds = settings.read_your_writes_seconds
+                cookie = f"{PRIMARY_COOKIE}={time.time() + seconds:.3f}; Max-Age={math.ceil(seconds)}; Path=/; HttpOnly; SameSite=Lax"
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", cookie.encode("latin-1"))]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
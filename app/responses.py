@@ -0,0 +1,91 @@
+"""
+JSON encoding for responses.
+
+dumps() encodes content that is already shaped like the response (dicts/lists, no validation),
+e.g. the projected post reads. orjson encodes datetimes natively; OPT_UTC_Z writes UTC as "Z"
+like Pydantic does, so both post read paths produce byte-identical bodies.
+
+The response classes render what FastAPI hands them after validating against the response_model.
+JSON_RESPONSE_BACKEND picks the app-wide default; a router or route can still pass its own
+default_response_class/response_class.
+
+export_response() streams the rows of a query as NDJSON or CSV for the bulk export routes.
+"""
+import csv
+import io
+from datetime import datetime
+from typing import Any
+import orjson
+from fastapi.responses import JSONResponse, StreamingResponse
+from .config import settings
+from .database import DbSession, stream_db
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _msgspec_response_class():
+    try:
+        import msgspec
+    except ImportError as error:
+        raise RuntimeError("JSON_RESPONSE_BACKEND=msgspec needs the `msgspec` package installed") from error
+
+    encoder = msgspec.json.Encoder()
+
+    class MsgspecJSONResponse(JSONResponse):
+        """JSONResponse rendered with msgspec."""
+
+        def render(self, content: Any) -> bytes:
+            return encoder.encode(content)
+
+    return MsgspecJSONResponse
+
+
+def response_class(backend: str) -> type[JSONResponse]:
+    """The JSON response class for a JSON_RESPONSE_BACKEND value: "orjson", "msgspec" or "stdlib"."""
+    if backend == "orjson":
+        return ORJSONResponse
+    if backend == "msgspec":
+        return _msgspec_response_class()
+    if backend == "stdlib":
+        return JSONResponse
+    raise ValueError(f"Unknown JSON_RESPONSE_BACKEND: {backend!r}")
+
+
+def _ndjson_lines(rows) -> bytes:
+    return b"".join(dumps(row._asdict()) + b"\n" for row in rows)
+
+
+def _csv_lines(rows) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(value.isoformat() if isinstance(value, datetime) else value for value in row)
+    return buffer.getvalue().encode()
+
+
+async def _export_chunks(db: DbSession, statement, format: str):
+    if format == "csv":
+        yield ",".join(statement.selected_columns.keys()).encode() + b"\r\n"
+    encode = _csv_lines if format == "csv" else _ndjson_lines
+    # One chunk per server-side cursor batch; StreamingResponse waits for the client before pulling the next
+    async for rows in stream_db(db, statement, settings.export_batch_size):
+        yield encode(rows)
+
+
+def export_response(db: DbSession, statement, format: str, name: str) -> StreamingResponse:
+    """
+    Streams the rows of a select() as `ndjson` (one object per row, keyed by column name) or `csv`
+    (a header row of the column names first), as the attachment `name`.`format`.
+    """
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="{name}.{format}"'}
+    return StreamingResponse(_export_chunks(db, statement, format), media_type=media_type, headers=headers)
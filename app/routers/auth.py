@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from .. import models, oauth2
-from ..database import get_db
-from ..utils import verify_password
+from .. import models, oauth2, schemas
+from ..database import DbSession, get_db, run_db
+from ..keyring import access_token_keyring
+from ..utils import PasswordHashingBusy, verify_and_update_password_async
 from ..schemas import Token, RefreshRequest, LogoutRequest
 
 router = APIRouter(
@@ -11,28 +12,45 @@ router = APIRouter(
     tags=["Authentication"] # to structure the docs
 )
 
+def _get_user_by_email(db: Session, email: str):
+    return db.query(models.User).filter(models.User.email == email).first()
+
+def _update_password_hash(db: Session, user_id: int, new_hash: str):
+    db.query(models.User).filter(models.User.id == user_id).update({"password": new_hash}, synchronize_session=False)
+    db.commit()
+
 @router.post("/login", response_model=Token)
-def login(input_user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(input_user_credentials: OAuth2PasswordRequestForm = Depends(), db: DbSession = Depends(get_db)):
     """
     Returns both the access and refresh tokens
     """
     
     # find user by email and store in db_user_credentials if exists
-    db_user_credentials = db.query(models.User).filter(models.User.email == input_user_credentials.username).first()
+    db_user_credentials = await run_db(db, _get_user_by_email, input_user_credentials.username)
 
     # if user not found, raise 404
     if db_user_credentials is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # verify password by comparing hashed passwords
-    if not verify_password(input_user_credentials.password, db_user_credentials.password):
+    # verify password by comparing hashed passwords (CPU heavy, so it runs in the hashing process pool)
+    try:
+        valid, new_hash = await verify_and_update_password_async(input_user_credentials.password, db_user_credentials.password)
+    except PasswordHashingBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server busy, try again shortly", headers={"Retry-After": "1"})
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    user_id = db_user_credentials.id
+
+    # The stored hash was made with older Argon2 parameters: replace it while we have the plain password
+    if new_hash:
+        await run_db(db, _update_password_hash, user_id, new_hash)
+
     # Create ACCESS token (short-lived)
-    access_token = oauth2.create_access_token(data={"user_id": db_user_credentials.id})
+    access_token = oauth2.create_access_token(data={"user_id": user_id})
     
     # Create REFRESH token (long-lived, 30 days, stored in DB)
-    refresh_token = oauth2.create_refresh_token(db_user_credentials.id, db)
+    refresh_token = await run_db(db, lambda session: oauth2.create_refresh_token(user_id, session))
 
     #Return BOTH tokens
     return {
@@ -42,28 +60,23 @@ def login(input_user_credentials: OAuth2PasswordRequestForm = Depends(), db: Ses
     }  
 
 @router.post("/refresh", response_model=Token)
-def refresh_token(request: RefreshRequest, db: Session = Depends(get_db)):
+async def refresh_token(request: RefreshRequest, db: DbSession = Depends(get_db)):
     """
     Refresh endpoint: Exchange a valid refresh token for a new access token.
     Also rotates the refresh token for added security.
     """
-    # Verify the refresh token
-    user_id = oauth2.verify_refresh_token(request.refresh_token, db)
+    rotated = await run_db(db, lambda session: oauth2.rotate_refresh_token(request.refresh_token, session))
     
-    if not user_id:
+    if rotated is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or expired refresh token"
         )
+    user_id, new_refresh_token = rotated
     
     # Create NEW access token
     access_token = oauth2.create_access_token(data={"user_id": user_id})
     
-    # OPTIONAL: Rotate refresh token (revoke old, create new)
-    # This is more secure but means user needs to store the new refresh token
-    oauth2.revoke_refresh_token(request.refresh_token, db)
-    new_refresh_token = oauth2.create_refresh_token(user_id, db)
-    
     # Return new tokens
     return {
         "access_token": access_token,
@@ -73,11 +86,11 @@ def refresh_token(request: RefreshRequest, db: Session = Depends(get_db)):
 
 # logout the user on the current device
 @router.post("/logout")
-def logout(request: LogoutRequest, db: Session = Depends(get_db)):
+async def logout(request: LogoutRequest, db: DbSession = Depends(get_db)):
     """
     Logout endpoint: Revokes the refresh token.
     """
-    success = oauth2.revoke_refresh_token(request.refresh_token, db)
+    success = await run_db(db, lambda session: oauth2.revoke_refresh_token(request.refresh_token, session))
     
     if not success:
         raise HTTPException(
@@ -89,11 +102,23 @@ def logout(request: LogoutRequest, db: Session = Depends(get_db)):
 
 
 @router.post("/logout-all")
-def logout_all(current_user: models.User = Depends(oauth2.get_current_user), db: Session = Depends(get_db)):
+async def logout_all(current_user: schemas.UserResponse | schemas.TokenData = Depends(oauth2.get_current_identity), db: DbSession = Depends(get_db)):
     """
     Logout from all devices: Revokes ALL refresh tokens for the current user.
     Requires a valid access token.
     """
-    oauth2.revoke_all_user_tokens(current_user.id, db)
+    user_id = current_user.id
+    await run_db(db, lambda session: oauth2.revoke_all_user_tokens(user_id, session))
     
-    return {"message": "Successfully logged out from all devices"}
\ No newline at end of file
+    return {"message": "Successfully logged out from all devices"}
+
+
+# Public keys for verifying access tokens without calling this API (see keyring.py)
+@router.get("/jwks.json")
+async def jwks(response: Response):
+    """
+    JSON Web Key Set of the keys access tokens are signed with, matched by the token's kid.
+    Empty with an HS* ALGORITHM: a shared secret is never published.
+    """
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return {"keys": access_token_keyring().jwks()}
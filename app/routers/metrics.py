@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from .. import metrics
+
+router = APIRouter(
+    tags=["Metrics"] # to structure the docs
+)
+
+# Prometheus scrape endpoint (values are per worker process)
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return metrics.render()
@@ -1,95 +1,366 @@
-from fastapi import Depends, HTTPException, status, Response, APIRouter
-from sqlalchemy import func
-from sqlalchemy.orm import Session
-from typing import List
-from .. import models, schemas, oauth2
-from ..database import get_db
+import asyncio
+import json
+from datetime import datetime
+from fastapi import Depends, HTTPException, status, Request, Response, APIRouter, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+from sqlalchemy import cast, exists, func, literal, select, tuple_
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from sqlalchemy.orm import Session, joinedload
+from typing import List, Literal, Optional
+from .. import models, schemas, oauth2, trending
+from ..cache import get_response_cache
+from ..config import settings
+from ..database import DbSession, get_db, run_db
+from ..live import Subscription, get_live_hub
+from ..replicas import get_read_db, reads_from_primary
+from ..responses import dumps, export_response
+from ..utils import encode_cursor, decode_cursor
 
 router = APIRouter(
     prefix="/posts",
     tags=["Posts"] #to structure the docs
 )
 
-# Get all posts
-@router.get("/", response_model=List[schemas.PostWithVotes])
-def get_post(db: Session = Depends(get_db),current_user: int = Depends(oauth2.get_current_user), limit: int = 10, skip: int = 0, search: str = ""):
-    # Join posts and votes to get vote counts for each post
-    posts = db.query(
+# Comment line sent on idle event streams so proxies don't time them out
+LIVE_KEEPALIVE_SECONDS = 15
+
+# Serializer for a page of the feed on the ORM read path
+_post_page = TypeAdapter(List[schemas.PostWithVotes])
+
+# The _functions below hold the ORM work for each route. Routes hand them to run_db so the same code
+# runs on the threadpool (sync engine) or inside AsyncSession.run_sync (async engine).
+# Responses with a nested owner are serialized inside the session, and every query that feeds one
+# joins the owner in the same statement (owner_id is NOT NULL, hence the inner join) instead of
+# lazy loading it with one extra SELECT per distinct owner.
+_with_owner = joinedload(models.Post.owner, innerjoin=True)
+
+# Columns of the projected read path: exactly what PostWithVotes renders, fetched as plain rows
+_post_row_columns = (
+    models.Post.id,
+    models.Post.title,
+    models.Post.content,
+    models.Post.is_published,
+    models.Post.created_at,
+    models.User.id.label("owner_id"),
+    models.User.email.label("owner_email"),
+    models.User.created_at.label("owner_created_at"),
+    models.Post.vote_count.label("votes"),
+)
+
+def _projection_reads(route_setting: bool | None) -> bool:
+    # A route's own POST_PROJECTION_READS_* setting wins over POST_PROJECTION_READS
+    return settings.post_projection_reads if route_setting is None else route_setting
+
+def _post_query(db: Session, projection: bool):
+    if projection:
+        return db.query(*_post_row_columns).join(models.Post.owner)
+    # Vote counts are stored on the post itself, so no join/aggregation over votes is needed
+    return db.query(
         models.Post, 
-        func.count(models.Vote.post_id).label("votes")
-    ).join(
-        models.Vote, 
-        models.Vote.post_id == models.Post.id, 
-        isouter=True  # LEFT JOIN (includes posts with 0 votes)
-    ).group_by(
-        models.Post.id
-    ).filter(
-        models.Post.title.contains(search)
-    ).limit(limit).offset(skip).all()
-    
-    return posts
+        models.Post.vote_count.label("votes")
+    ).options(_with_owner)
 
-#get single post
-@router.get("/{id}", response_model=schemas.PostWithVotes)
-def get_post(id: int, db: Session = Depends(get_db)):
+def _post_row_json(row) -> dict:
+    # Same shape (and key order) as schemas.PostWithVotes, without validating or hydrating anything
+    return {
+        "Post": {
+            "title": row.title,
+            "content": row.content,
+            "is_published": row.is_published,
+            "id": row.id,
+            "created_at": row.created_at,
+            "owner": {"id": row.owner_id, "email": row.owner_email, "created_at": row.owner_created_at},
+        },
+        "votes": row.votes,
+    }
+
+def _encode_posts(rows: list, projection: bool) -> bytes:
+    if projection:
+        return dumps([_post_row_json(row) for row in rows])
+    return _post_page.dump_json([schemas.PostWithVotes.model_validate(row) for row in rows])
+
+def _list_posts(db: Session, limit: int, skip: int, search: str, after: Optional[tuple], projection: bool):
+    """Returns the encoded page, and the (created_at, id) to continue after if there may be more posts."""
+    query = _post_query(db, projection)
+
+    if search:
+        rows = _search_posts(db, query, limit, skip, search)
+    else:
+        query = query.order_by(
+            models.Post.created_at.desc(),
+            models.Post.id.desc()
+        )
+
+        if after:
+            # Seek past the last seen row using the (created_at, id) index instead of counting rows with OFFSET
+            query = query.filter(tuple_(models.Post.created_at, models.Post.id) < tuple_(*after))
+        else:
+            query = query.offset(skip)
+
+        rows = query.limit(limit).all()
+
+    # A full feed page means there may be more rows after the last one (search results page with skip)
+    next_position = None
+    if not search and rows and len(rows) == limit:
+        last = getattr(rows[-1], "Post", rows[-1])
+        next_position = (last.created_at, last.id)
+    return _encode_posts(rows, projection), next_position
+
+def _search_posts(db: Session, query, limit: int, skip: int, search: str):
+    # Full-text search over title + content using the GIN index on search_vector, best matches first
+    ts_query = func.websearch_to_tsquery(cast(models.SEARCH_CONFIG, REGCONFIG), search)
+    matches = models.Post.search_vector.op("@@")(ts_query)
+    rows = query.filter(matches).order_by(
+        func.ts_rank(models.Post.search_vector, ts_query).desc(),
+        models.Post.id.desc()
+    ).offset(skip).limit(limit).all()
+
+    # Nothing matched as whole words (typo, partial word): try trigram similarity on the title instead
+    if not rows and settings.search_trigram_fallback:
+        if skip == 0 or not db.query(exists().where(matches)).scalar():
+            rows = query.filter(
+                literal(search).op("<%")(models.Post.title)  # word_similarity above pg_trgm's threshold
+            ).order_by(
+                func.word_similarity(search, models.Post.title).desc(),
+                models.Post.id.desc()
+            ).offset(skip).limit(limit).all()
+
+    return rows
+
+def _list_trending(db: Session, limit: int, skip: int, projection: bool) -> bytes:
+    # Walks ix_post_scores_score_post_id from the top; only `skip + limit` score rows are read
+    rows = _post_query(db, projection).join(
+        models.PostScore, models.PostScore.post_id == models.Post.id
+    ).order_by(
+        models.PostScore.score.desc(),
+        models.PostScore.post_id.desc()
+    ).offset(skip).limit(limit).all()
+    return _encode_posts(rows, projection)
+
+# Flat columns of GET /posts/export, in CSV column order
+_export_columns = (
+    models.Post.id,
+    models.Post.owner_id,
+    models.Post.title,
+    models.Post.content,
+    models.Post.is_published,
+    models.Post.created_at,
+    models.Post.vote_count.label("votes"),
+)
+
+async def _live_events(id: int, state: dict):
+    async with get_live_hub().subscribe(id, state) as subscription:
+        while True:
+            try:
+                state = await asyncio.wait_for(subscription.get(), LIVE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            yield b"data: " + dumps(state) + b"\n\n"
+            if state.get("deleted"):
+                return
+
+async def _send_live_states(websocket: WebSocket, subscription: Subscription):
+    while True:
+        state = await subscription.get()
+        await websocket.send_text(dumps(state).decode())
+        if state.get("deleted"):
+            await websocket.close()
+            return
+
+async def _wait_for_disconnect(websocket: WebSocket):
+    # Clients aren't expected to send anything; this only notices when they leave
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+def _get_post(db: Session, id: int, projection: bool):
     # Query for a single post with vote count
-    post = db.query(
-        models.Post, 
-        func.count(models.Vote.post_id).label("votes")
-    ).join(
-        models.Vote, 
-        models.Vote.post_id == models.Post.id, 
-        isouter=True
-    ).group_by(
-        models.Post.id
-    ).filter(
+    post = _post_query(db, projection).filter(
         models.Post.id == id
     ).first()
     
     if not post:
         raise HTTPException(status_code=404, detail=f"Post with id: {id} not found")
     
-    return post
+    if projection:
+        return dumps(_post_row_json(post))
+    return schemas.PostWithVotes.model_validate(post).model_dump_json().encode()
 
-# create posts
-@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.Post)
-def create_post(post: schemas.PostCreate, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
-    new_post = models.Post(owner_id=current_user.id, **post.model_dump())
-    # new_post.owner_id = current_user.id
+def _create_post(db: Session, post: schemas.PostCreate, owner_id: int):
+    new_post = models.Post(owner_id=owner_id, **post.model_dump())
     db.add(new_post)
+    db.flush()  # INSERT ... RETURNING fills in id/created_at
+    post_id = new_post.id
+    trending.add_post_score(db, post_id)
     db.commit()
-    db.refresh(new_post)
-    return new_post
+    # Read back post and owner together rather than refresh() + a lazy load of the owner
+    created = db.query(models.Post).options(_with_owner).populate_existing().filter(models.Post.id == post_id).one()
+    return schemas.Post.model_validate(created)
 
-#delete post
-@router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_post(id: int, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
+def _delete_post(db: Session, id: int, user_id: int):
     post_query = db.query(models.Post).filter(models.Post.id == id)
     post = post_query.first()
 
     if post is None:
         raise HTTPException(status_code=404, detail=f"Post with id: {id} not found")
     
-    if post.owner_id != current_user.id:
+    if post.owner_id != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform requested action")
 
     post_query.delete(synchronize_session=False)
     db.commit()
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-# update post
-@router.put("/{id}", response_model=schemas.Post)
-def update_post(id: int, payload: schemas.PostCreate, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
-    post_query = db.query(models.Post).filter(models.Post.id == id)
-    post = post_query.first()
+def _update_post(db: Session, id: int, payload: schemas.PostCreate, user_id: int):
+    post = db.query(models.Post).options(_with_owner).filter(models.Post.id == id).first()
     
     if post is None:
         raise HTTPException(status_code=404, detail=f"Post with id: {id} not found")
     
-    if post.owner_id != current_user.id:
+    if post.owner_id != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform requested action")
     
-    post_query.update(payload.model_dump(exclude_unset=True), synchronize_session=False)
+    for key, value in payload.model_dump(exclude_unset=True).items():
+        setattr(post, key, value)
+    # Nothing in the response is generated by the UPDATE, so serialize now instead of reloading after commit
+    updated = schemas.Post.model_validate(post)
     db.commit()
-    db.refresh(post)
-    return post
\ No newline at end of file
+    return updated
+
+# Get all posts
+@router.get("/", response_model=List[schemas.PostWithVotes])
+async def get_post(request: Request, db: DbSession = Depends(get_read_db),current_user: int = Depends(oauth2.get_current_identity), limit: int = 10, skip: int = 0, search: str = "", after: Optional[str] = None):
+    """
+    Returns posts newest first. Pass the X-Next-Cursor header of a page as `after`
+    to fetch the next one (keyset pagination). `skip` is kept for older clients
+    and is ignored when `after` is given.
+
+    With `search`, posts are ranked by relevance and paged with `skip` only.
+    Responses carry an ETag; send it back in If-None-Match to get a 304.
+    """
+    if search and after:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Search results are paged with skip, not after")
+
+    position = None
+    if after:
+        try:
+            position = decode_cursor(after)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    # The feed is the same for every user, so the serialized page is shared
+    cached, cache_key = await get_response_cache().lookup("feed", json.dumps([limit, skip, search, after]))
+    # Entries may have been computed on a lagging replica; clients that just wrote get a fresh read
+    if cached and not reads_from_primary(request):
+        return cached.to_response(request)
+
+    body, next_position = await run_db(db, _list_posts, limit, skip, search, position, _projection_reads(settings.post_projection_reads_feed))
+    headers = {"X-Next-Cursor": encode_cursor(*next_position)} if next_position else {}
+    
+    entry = await get_response_cache().store(cache_key, body, headers)
+    return entry.to_response(request)
+
+# Trending posts (declared before /{id} so "trending" isn't taken for an id)
+@router.get("/trending", response_model=List[schemas.PostWithVotes])
+async def get_trending_posts(request: Request, db: DbSession = Depends(get_read_db), current_user: int = Depends(oauth2.get_current_identity), limit: int = 10, skip: int = 0):
+    """
+    Returns recent posts ranked by votes with a time decay, hottest first (see trending.py).
+    Rankings move as votes come in, so pages are fetched with `skip`.
+    """
+    cached, cache_key = await get_response_cache().lookup("trending", json.dumps([limit, skip]))
+    if cached and not reads_from_primary(request):
+        return cached.to_response(request)
+
+    body = await run_db(db, _list_trending, limit, skip, _projection_reads(settings.post_projection_reads_trending))
+    entry = await get_response_cache().store(cache_key, body)
+    return entry.to_response(request)
+
+# Bulk export (declared before /{id} as well)
+@router.get("/export")
+async def export_posts(db: DbSession = Depends(get_read_db), current_user: int = Depends(oauth2.get_current_identity), format: Literal["ndjson", "csv"] = "ndjson", owner_id: Optional[int] = None, created_after: Optional[datetime] = None, created_before: Optional[datetime] = None):
+    """
+    Streams every post matching the filters, oldest first, with its vote count: one JSON object
+    per line (`ndjson`) or `csv` with a header row. `created_after` is inclusive, `created_before`
+    exclusive. Rows are read through a server-side cursor, so exports of any size use flat memory.
+    """
+    statement = select(*_export_columns).order_by(models.Post.created_at, models.Post.id)
+    if owner_id is not None:
+        statement = statement.where(models.Post.owner_id == owner_id)
+    if created_after is not None:
+        statement = statement.where(models.Post.created_at >= created_after)
+    if created_before is not None:
+        statement = statement.where(models.Post.created_at < created_before)
+
+    return export_response(db, statement, format, "posts")
+
+# Live updates of a post: Server-Sent Events here, or a WebSocket on the same path
+@router.get("/{id}/live")
+async def get_live_post(id: int):
+    """
+    Streams the post's state (title, content, is_published, votes) as Server-Sent Events, once on
+    connect and then on every change, at most once per LIVE_TICK_MS. The last event is
+    `{"post_id": id, "deleted": true}` if the post is deleted. A WebSocket on this path sends the
+    same messages.
+    """
+    state = await get_live_hub().current(id)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"Post with id: {id} not found")
+    return StreamingResponse(
+        _live_events(id, state),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.websocket("/{id}/live")
+async def live_post_socket(websocket: WebSocket, id: int):
+    await websocket.accept()
+    state = await get_live_hub().current(id)
+    if state is None:
+        await websocket.close(code=4404, reason=f"Post with id: {id} not found")
+        return
+
+    async with get_live_hub().subscribe(id, state) as subscription:
+        sender = asyncio.create_task(_send_live_states(websocket, subscription))
+        receiver = asyncio.create_task(_wait_for_disconnect(websocket))
+        done, pending = await asyncio.wait((sender, receiver), return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            error = task.exception()
+            # The client may be gone by the time a state is sent
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                raise error
+
+#get single post
+@router.get("/{id}", response_model=schemas.PostWithVotes)
+async def get_post(id: int, request: Request, db: DbSession = Depends(get_read_db)):
+    cached, cache_key = await get_response_cache().lookup(f"post:{id}")
+    if cached and not reads_from_primary(request):
+        return cached.to_response(request)
+
+    body = await run_db(db, _get_post, id, _projection_reads(settings.post_projection_reads_detail))
+    entry = await get_response_cache().store(cache_key, body)
+    return entry.to_response(request)
+
+# create posts
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.Post)
+async def create_post(post: schemas.PostCreate, db: DbSession = Depends(get_db), current_user: int = Depends(oauth2.get_current_identity)):
+    new_post = await run_db(db, _create_post, post, current_user.id)
+    await get_response_cache().invalidate("feed", "trending")
+    return new_post
+
+#delete post
+@router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_post(id: int, db: DbSession = Depends(get_db), current_user: int = Depends(oauth2.get_current_identity)):
+    await run_db(db, _delete_post, id, current_user.id)
+    await get_response_cache().invalidate("feed", "trending", f"post:{id}")
+    get_live_hub().publish(id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+# update post
+@router.put("/{id}", response_model=schemas.Post)
+async def update_post(id: int, payload: schemas.PostCreate, db: DbSession = Depends(get_db), current_user: int = Depends(oauth2.get_current_identity)):
+    post = await run_db(db, _update_post, id, payload, current_user.id)
+    await get_response_cache().invalidate("feed", "trending", f"post:{id}")
+    get_live_hub().publish(id)
+    return post
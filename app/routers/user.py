@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from .. import models, schemas
-from ..database import get_db
-from ..utils import hash_password
+from ..database import DbSession, get_db, run_db
+from ..replicas import get_read_db
+from ..utils import PasswordHashingBusy, hash_password_async
 from sqlalchemy.exc import IntegrityError
 
 router = APIRouter(
@@ -10,12 +11,8 @@ router = APIRouter(
     tags=["Users"] # to structure the docs
 )
 
-# create user
-@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.UserResponse)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+def _create_user(db: Session, user: schemas.UserCreate):
     try:
-        # Hash the user's password before storing it
-        user.password = hash_password(user.password)
         new_user = models.User(**user.model_dump())
         db.add(new_user)
         db.commit()
@@ -26,10 +23,23 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,detail=f"An account with email '{user.email}' already exists")
 
-# get user data
-@router.get("/{id}", response_model=schemas.UserResponse)
-def get_user(id: int, db: Session = Depends(get_db)):
+def _get_user(db: Session, id: int):
     user = db.query(models.User).filter(models.User.id == id).first()
     if user is None:
         raise HTTPException(status_code=404, detail=f"User with id: {id} not found")
-    return user
\ No newline at end of file
+    return user
+
+# create user
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.UserResponse)
+async def create_user(user: schemas.UserCreate, db: DbSession = Depends(get_db)):
+    # Hash the user's password before storing it. Hashing is CPU heavy, so it runs in the hashing process pool
+    try:
+        user.password = await hash_password_async(user.password)
+    except PasswordHashingBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server busy, try again shortly", headers={"Retry-After": "1"})
+    return await run_db(db, _create_user, user)
+
+# get user data
+@router.get("/{id}", response_model=schemas.UserResponse)
+async def get_user(id: int, db: DbSession = Depends(get_read_db)):
+    return await run_db(db, _get_user, id)
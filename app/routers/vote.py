@@ -1,36 +1,171 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from .. import models, schemas, database, oauth2
+from .. import models, schemas, database, oauth2, trending
+from sqlalchemy import Integer, and_, column, delete, func, literal_column, select, union_all, update, values
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
-from ..database import get_db
+from functools import cache
+from typing import List, Literal, Optional
+from ..cache import get_response_cache
+from ..config import settings
+from ..database import DbSession, get_db, release_db, run_db
+from ..live import get_live_hub
+from ..replicas import get_read_db
+from ..responses import export_response
+from ..vote_buffer import VoteBuffer
 
 router = APIRouter(
     prefix="/vote",
     tags=["Votes"] # to structure the docs
 )
 
+def _apply_vote_rows(db: Session, votes: dict[tuple[int, int], int]) -> dict[tuple[int, int], str]:
+    """
+    Applies {(user_id, post_id): dir} with a single statement and commit, whatever the number of
+    votes and users: upvotes are INSERT ... ON CONFLICT DO NOTHING, removals are DELETE ... USING,
+    the denormalized posts.vote_count is adjusted by the rows those actually changed, and the
+    trending score of each changed post is recomputed from its new count.
+    Returns the outcome of each vote: added, removed, already_voted, not_voted or post_not_found.
+    """
+    requested = select(
+        values(column("user_id", Integer), column("post_id", Integer), column("dir", Integer), name="requested_values")
+        .data([(user_id, post_id, dir) for (user_id, post_id), dir in votes.items()])
+    ).cte("requested")
+    existing = select(models.Post.id).where(models.Post.id.in_(select(requested.c.post_id))).cte("existing")
+
+    inserted = insert(models.Vote).from_select(
+        ["user_id", "post_id"],
+        select(requested.c.user_id, requested.c.post_id)
+        .join(existing, existing.c.id == requested.c.post_id)
+        .where(requested.c.dir == 1)
+    ).on_conflict_do_nothing().returning(models.Vote.user_id, models.Vote.post_id).cte("inserted")
+
+    deleted = delete(models.Vote).where(
+        models.Vote.user_id == requested.c.user_id,
+        models.Vote.post_id == requested.c.post_id,
+        requested.c.dir == 0
+    ).returning(models.Vote.user_id, models.Vote.post_id).cte("deleted")
+
+    changes = union_all(
+        select(inserted.c.user_id, inserted.c.post_id, literal_column("1").label("delta")),
+        select(deleted.c.user_id, deleted.c.post_id, literal_column("-1").label("delta")),
+    ).cte("changes")
+
+    # One row per post: an UPDATE ... FROM applies only one of several joined rows to the same target
+    deltas = select(
+        changes.c.post_id, func.sum(changes.c.delta).label("delta")
+    ).group_by(changes.c.post_id).cte("deltas")
+
+    counted = update(models.Post).where(
+        models.Post.id == deltas.c.post_id
+    ).values(
+        vote_count=models.Post.vote_count + deltas.c.delta
+    ).returning(models.Post.id, models.Post.vote_count, models.Post.created_at).cte("counted")
+
+    # Posts outside the trending window have no score row, so this only touches recent posts
+    rescored = update(models.PostScore).where(
+        models.PostScore.post_id == counted.c.id
+    ).values(
+        score=trending.score_expression(counted.c.vote_count, counted.c.created_at)
+    ).returning(models.PostScore.post_id).cte("rescored")
+
+    rows = db.execute(
+        select(
+            requested.c.user_id,
+            requested.c.post_id,
+            requested.c.dir,
+            existing.c.id.is_not(None).label("post_exists"),
+            changes.c.post_id.is_not(None).label("applied"),
+        )
+        .outerjoin(existing, existing.c.id == requested.c.post_id)
+        .outerjoin(changes, and_(changes.c.user_id == requested.c.user_id, changes.c.post_id == requested.c.post_id))
+        # Referenced only so the CTE (and counted, through it) is part of the statement
+        .outerjoin(rescored, rescored.c.post_id == requested.c.post_id)
+    ).all()
+    db.commit()
+
+    outcome = {}
+    for row in rows:
+        if not row.post_exists:
+            status = "post_not_found"
+        elif row.dir == 1:
+            status = "added" if row.applied else "already_voted"
+        else:
+            status = "removed" if row.applied else "not_voted"
+        outcome[row.user_id, row.post_id] = status
+    return outcome
+
+def _apply_votes(db: Session, votes: List[schemas.Vote], user_id: int) -> List[schemas.VoteResult]:
+    """Applies one user's votes in one statement; only the last entry per post counts."""
+    # The statement can't apply two changes to the same row in order
+    final = {(user_id, vote.post_id): vote.dir for vote in votes}
+    outcome = _apply_vote_rows(db, final)
+
+    results = []
+    for index, vote in enumerate(votes):
+        superseded = any(later.post_id == vote.post_id for later in votes[index + 1:])
+        results.append(schemas.VoteResult(
+            post_id=vote.post_id,
+            dir=vote.dir,
+            status="superseded" if superseded else outcome[user_id, vote.post_id],
+        ))
+    return results
+
+# With VOTE_BATCH_WRITES, single votes are queued and written in batches (see vote_buffer.py).
+# Built on first use; the lifespan builds it at startup, starts it and closes it on shutdown.
+@cache
+def get_vote_buffer() -> VoteBuffer | None:
+    if not settings.vote_batch_writes:
+        return None
+    return VoteBuffer(_apply_vote_rows, settings.vote_batch_interval_ms / 1000, settings.vote_batch_max_size)
+
 @router.post("/", status_code=status.HTTP_201_CREATED)
-def vote(vote: schemas.Vote, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
-    # Check if the post exists
-    post = db.query(models.Post).filter(models.Post.id == vote.post_id).first()
-    if not post:
+async def vote(vote: schemas.Vote, db: DbSession = Depends(get_db), current_user: int = Depends(oauth2.get_current_identity)):
+    vote_buffer = get_vote_buffer()
+    if vote_buffer is not None:
+        # Don't keep the connection of the user lookup checked out while the batch is pending
+        await release_db(db)
+        outcome = await vote_buffer.submit(current_user.id, vote.post_id, vote.dir)
+    else:
+        [result] = await run_db(db, _apply_votes, [vote], current_user.id)
+        outcome = result.status
+
+    if outcome == "post_not_found":
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id: {vote.post_id} does not exist")
-    
-    # Check if the user has already voted on this post
-    vote_query = db.query(models.Vote).filter(models.Vote.post_id == vote.post_id, models.Vote.user_id == current_user.id)
-    found_vote = vote_query.first()
-
-    if vote.dir == 1:
-        # User is trying to upvote
-        if found_vote:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"user {current_user.id} has already voted on post {vote.post_id}")
-        new_vote = models.Vote(post_id=vote.post_id, user_id=current_user.id)
-        db.add(new_vote)
-        db.commit()
+    if outcome == "already_voted":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"user {current_user.id} has already voted on post {vote.post_id}")
+    if outcome == "not_voted":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Vote does not exist")
+
+    # Vote counts are part of the cached feed and post responses, and they move the trending ranking
+    await get_response_cache().invalidate("feed", "trending", f"post:{vote.post_id}")
+    get_live_hub().publish(vote.post_id)
+    if outcome == "added":
         return {"message": "Successfully added vote"}
-    else:
-        # User is trying to remove their vote
-        if not found_vote:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Vote does not exist")
-        vote_query.delete(synchronize_session=False)
-        db.commit()
-        return {"message": "Successfully removed vote"}
\ No newline at end of file
+    return {"message": "Successfully removed vote"}
+
+# Apply many votes at once, e.g. a mobile client flushing votes queued while offline
+@router.post("/batch", response_model=List[schemas.VoteResult])
+async def vote_batch(batch: schemas.VoteBatch, db: DbSession = Depends(get_db), current_user: int = Depends(oauth2.get_current_identity)):
+    results = await run_db(db, _apply_votes, batch.votes, current_user.id)
+
+    changed = {result.post_id for result in results if result.status in ("added", "removed")}
+    if changed:
+        await get_response_cache().invalidate("feed", "trending", *(f"post:{post_id}" for post_id in changed))
+        get_live_hub().publish(*changed)
+    return results
+
+# Bulk export, the counterpart of GET /posts/export for individual votes
+@router.get("/export")
+async def export_votes(db: DbSession = Depends(get_read_db), current_user: int = Depends(oauth2.get_current_identity), format: Literal["ndjson", "csv"] = "ndjson", user_id: Optional[int] = None, post_id: Optional[int] = None):
+    """
+    Streams every vote matching the filters as (user_id, post_id) pairs, ordered by user then post:
+    one JSON object per line (`ndjson`) or `csv` with a header row. Votes carry no timestamp, so
+    there is no time filter. Rows are read through a server-side cursor, like GET /posts/export.
+    """
+    # Walks the (user_id, post_id) primary key, or ix_votes_post_id for a single post
+    statement = select(models.Vote.user_id, models.Vote.post_id).order_by(models.Vote.user_id, models.Vote.post_id)
+    if user_id is not None:
+        statement = statement.where(models.Vote.user_id == user_id)
+    if post_id is not None:
+        statement = statement.where(models.Vote.post_id == post_id)
+    return export_response(db, statement, format, "votes")
@@ -1,4 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
+from typing import List, Literal
 from datetime import datetime
 # Pydantic model for request body validation
 class PostBase(BaseModel):
@@ -35,6 +36,9 @@ class UserResponse(BaseModel):
     email: EmailStr
     created_at: datetime
 
+    class Config:
+        from_attributes = True
+
 # for token response
 class Token(BaseModel):
     access_token: str
@@ -54,4 +58,14 @@ class LogoutRequest(BaseModel):
     
 class Vote(BaseModel):
     post_id: int
-    dir: int = Field(ge=0, le=1, description="1 for upvote, 0 for remove vote") # Field is used to add metadata to the field
\ No newline at end of file
+    dir: int = Field(ge=0, le=1, description="1 for upvote, 0 for remove vote") # Field is used to add metadata to the field
+
+# Offline clients flush their queued votes in one request
+class VoteBatch(BaseModel):
+    votes: List[Vote] = Field(min_length=1, max_length=500)
+
+class VoteResult(BaseModel):
+    post_id: int
+    dir: int
+    # superseded: a later entry in the same batch targets the same post, only the last one is applied
+    status: Literal["added", "removed", "already_voted", "not_voted", "post_not_found", "superseded"]
@@ -0,0 +1,83 @@
+"""
+Production entry point: runs the app under uvicorn with one worker process per available CPU.
+
+    python -m app.serve                 # workers, keep-alive, backlog, ... from the SERVER_* settings
+    python -m app.serve --workers 4     # override the worker count
+
+uvloop and httptools are required (they are pinned in requirements.txt). On SIGTERM the supervisor
+stops every worker; each one stops accepting connections, lets in-flight requests finish for up to
+SERVER_GRACEFUL_SHUTDOWN_SECONDS, then runs the app's shutdown. Each worker warms its connection pool
+before it starts accepting (see main.lifespan).
+"""
+import argparse
+import logging
+import math
+import os
+from pathlib import Path
+import uvicorn
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _cgroup_cpu_limit() -> float | None:
+    """CPUs allowed by the container's CFS quota (cgroup v2, then v1), or None when unlimited."""
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        quota = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read_text())
+        period = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read_text())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus() -> int:
+    """CPUs this process may actually use: its affinity mask, capped by the cgroup quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS
+        cpus = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, math.ceil(limit))
+    return max(1, cpus)
+
+
+def worker_count() -> int:
+    return settings.server_workers if settings.server_workers > 0 else available_cpus()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m app.serve", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=settings.server_host)
+    parser.add_argument("--port", type=int, default=settings.server_port)
+    parser.add_argument("--workers", type=int, default=worker_count(), help="default: SERVER_WORKERS, or one per available CPU")
+    args = parser.parse_args(argv)
+
+    if not settings.database_external_pooler:
+        # Every worker has its own pool
+        connections = args.workers * (settings.database_pool_size + settings.database_max_overflow)
+        logger.info("Starting %d worker(s), up to %d database connection(s) in total", args.workers, connections)
+
+    uvicorn.run(
+        "app.main:create_app",
+        factory=True,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="uvloop",
+        http="httptools",
+        backlog=settings.server_backlog,
+        timeout_keep_alive=settings.server_keep_alive_seconds,
+        limit_concurrency=settings.server_limit_concurrency or None,
+        timeout_graceful_shutdown=settings.server_graceful_shutdown_seconds,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,98 @@
+"""
+Trending ranking for GET /posts/trending.
+
+score = log10(max(votes, 1)) + (created_at - epoch) / TRENDING_DECAY_SECONDS
+
+Newer posts get a higher baseline, so a post needs 10x the votes of one TRENDING_DECAY_SECONDS
+younger to rank alongside it. Decay comes from the ordering itself: scores never have to be
+recomputed as time passes, only when a post's votes change. post_scores holds the posts of the
+last TRENDING_WINDOW_DAYS and is maintained in the same transaction as posts and votes. The
+periodic refresh drops posts that left the window and repairs any drift (posts or votes written
+outside the API, or a changed decay setting).
+"""
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import Float, cast, delete, extract, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from . import database, metrics, models
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# 2026-01-01T00:00:00Z, keeps the time term small
+EPOCH = 1767225600
+
+trending_refresh_duration = metrics.Histogram("trending_refresh_seconds", "Duration of a trending score refresh")
+trending_rescored_total = metrics.Counter("trending_rescored_total", "post_scores rows inserted or corrected by the refresh")
+
+
+def score_expression(vote_count, created_at):
+    """SQL expression for the trending score of a post with the given vote count and creation time."""
+    age_term = (cast(extract("epoch", created_at), Float) - EPOCH) / settings.trending_decay_seconds
+    return cast(func.log(func.greatest(vote_count, 1)), Float) + age_term
+
+
+def add_post_score(db: Session, post_id: int):
+    """Scores a new post (in the caller's transaction)."""
+    db.execute(
+        insert(models.PostScore).from_select(
+            ["post_id", "score"],
+            select(models.Post.id, score_expression(models.Post.vote_count, models.Post.created_at)).where(models.Post.id == post_id),
+        ).on_conflict_do_nothing()
+    )
+
+
+def refresh_trending_scores(db: Session) -> tuple[int, int]:
+    """Drops posts older than the window and (re)scores the rest. Returns (rescored, dropped)."""
+    started = time.perf_counter()
+    table = models.PostScore.__table__
+    posts = models.Post.__table__
+    window_start = datetime.now(timezone.utc) - timedelta(days=settings.trending_window_days)
+
+    dropped = db.execute(
+        delete(table).where(table.c.post_id == posts.c.id, posts.c.created_at < window_start)
+    ).rowcount
+
+    upsert = insert(table).from_select(
+        ["post_id", "score"],
+        select(posts.c.id, score_expression(posts.c.vote_count, posts.c.created_at)).where(posts.c.created_at >= window_start),
+    )
+    # rowcount isn't reported for INSERT ... SELECT, so count the returned rows
+    rescored = len(db.execute(
+        upsert.on_conflict_do_update(
+            index_elements=[table.c.post_id],
+            set_={"score": upsert.excluded.score},
+            where=table.c.score != upsert.excluded.score,
+        ).returning(table.c.post_id)
+    ).all())
+    db.commit()
+
+    trending_rescored_total.inc(rescored)
+    trending_refresh_duration.observe(time.perf_counter() - started)
+    return rescored, dropped
+
+
+def _refresh_job() -> tuple[int, int]:
+    db = database.SessionLocal()
+    try:
+        return refresh_trending_scores(db)
+    finally:
+        db.close()
+
+
+async def refresh_trending_periodically(interval: float):
+    """Runs refresh_trending_scores every `interval` seconds until cancelled."""
+    # Workers start together; spread their refreshes over the interval
+    await asyncio.sleep(random.uniform(0, interval))
+    while True:
+        try:
+            rescored, dropped = await run_in_threadpool(_refresh_job)
+            logger.info("Trending refresh: %d post(s) rescored, %d dropped", rescored, dropped)
+        except Exception:
+            logger.exception("Trending refresh failed")
+        await asyncio.sleep(interval)
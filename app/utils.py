@@ -1,12 +1,103 @@
-from pwdlib import PasswordHash
+import base64
+import binascii
+import json
+from datetime import datetime
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import cache
+from starlette.concurrency import run_in_threadpool
+from .config import settings
 
-# Password hashing context for securely storing passwords
-password_hash_context = PasswordHash.recommended()
+logger = logging.getLogger(__name__)
+
+# Password hashing context for securely storing passwords. Built on first use (in each hashing
+# process too), so importing this module doesn't load the Argon2 bindings.
+@cache
+def password_hash_context():
+    from pwdlib import PasswordHash
+    from pwdlib.hashers.argon2 import Argon2Hasher
+
+    return PasswordHash((
+        Argon2Hasher(
+            time_cost=settings.argon2_time_cost,
+            memory_cost=settings.argon2_memory_cost,
+            parallelism=settings.argon2_parallelism,
+        ),
+    ))
 
 def hash_password(plain_password: str) -> str:
     """Hash a plain password."""
-    return password_hash_context.hash(plain_password)
+    return password_hash_context().hash(plain_password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a plain password against a hashed password."""
-    return password_hash_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return password_hash_context().verify(plain_password, hashed_password)
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """Verify a password. Also returns a new hash if the stored one uses outdated Argon2 parameters."""
+    return password_hash_context().verify_and_update(plain_password, hashed_password)
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when too many hashing requests are already waiting in this worker, or the hashing pool just broke."""
+
+# Argon2 is CPU and memory heavy, so hashing runs in a separate process pool instead of competing
+# with request handling for the GIL and the threadpool. Created on first use, shut down with the app.
+_hash_executor: ProcessPoolExecutor | None = None
+_hash_pending = 0
+
+async def _run_hasher(fn, *args):
+    global _hash_executor, _hash_pending
+    # Backpressure: fail fast instead of queueing logins behind a growing backlog
+    if _hash_pending >= settings.password_hash_max_pending:
+        raise PasswordHashingBusy()
+    _hash_pending += 1
+    try:
+        if settings.password_hash_workers <= 0:
+            return await run_in_threadpool(fn, *args)
+        if _hash_executor is None:
+            _hash_executor = ProcessPoolExecutor(max_workers=settings.password_hash_workers)
+        executor = _hash_executor
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        except BrokenProcessPool as error:
+            # A hashing process died (OOM kill, crash): the pool is unusable, so the next call starts a new one
+            # and this request gets a 503 instead of every later one failing
+            if _hash_executor is executor:
+                logger.warning("Password hashing pool broke, replacing it: %s", error)
+                executor.shutdown(wait=False, cancel_futures=True)
+                _hash_executor = None
+            raise PasswordHashingBusy() from error
+    finally:
+        _hash_pending -= 1
+
+async def hash_password_async(plain_password: str) -> str:
+    """hash_password without blocking the event loop. Raises PasswordHashingBusy when overloaded."""
+    return await _run_hasher(hash_password, plain_password)
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """verify_and_update_password without blocking the event loop. Raises PasswordHashingBusy when overloaded."""
+    return await _run_hasher(verify_and_update_password, plain_password, hashed_password)
+
+def shutdown_password_hasher():
+    """Stop the hashing processes (called on app shutdown)."""
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(cancel_futures=True)
+        _hash_executor = None
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    """Encode the (created_at, id) position of a post into an opaque cursor."""
+    raw = json.dumps([created_at.isoformat(), id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Decode a cursor produced by encode_cursor. Raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(id)
+    except (TypeError, binascii.Error, json.JSONDecodeError, UnicodeDecodeError) as error:
+        raise ValueError("Invalid cursor") from error
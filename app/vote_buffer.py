@@ -0,0 +1,141 @@
+"""
+Batched vote writes (VOTE_BATCH_WRITES).
+
+Instead of one transaction per POST /vote/, each worker queues incoming votes and a background task
+writes everything queued every VOTE_BATCH_INTERVAL_MS (or as soon as VOTE_BATCH_MAX_SIZE votes are
+waiting) with one multi-row statement and one commit. The commit rate then no longer follows the
+request rate, and concurrent votes on a hot post update its row once per batch instead of queuing on
+its row lock.
+
+Durability is unchanged: a request waits for the commit of the batch holding its vote and answers
+with that vote's own outcome (added, already_voted, ...), so an acknowledged vote is always stored.
+A worker that dies loses only the votes it had not answered yet. The price is latency: up to
+VOTE_BATCH_INTERVAL_MS more per vote. A vote the statement can't store (its post deleted meanwhile,
+its user gone) makes the whole batch fail: the batch is then written again in halves, down to the
+votes that fail on their own, so only their requests get the error. Other errors (a lost connection)
+fail every request in the batch.
+"""
+import asyncio
+import logging
+import time
+from sqlalchemy import exc
+from . import database, metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+vote_batch_seconds = metrics.Histogram("vote_batch_flush_seconds", "Time to write one batch of queued votes")
+vote_batch_size = metrics.Histogram("vote_batch_flush_size", "Votes written per batch", buckets=BATCH_SIZE_BUCKETS)
+vote_batch_errors_total = metrics.Counter("vote_batch_flush_errors_total", "Batches (or single votes split off a failed batch) that failed to write")
+
+_running = []
+metrics.Gauge("vote_batch_queue_depth", "Votes waiting to be written", lambda: sum(buffer.depth for buffer in _running))
+
+
+class VoteBuffer:
+    """
+    Queues (user_id, post_id) -> dir votes and writes them in batches with `apply(session, votes)`,
+    which returns the outcome of each vote. A vote for a pair already waiting in the current batch
+    goes into the next one, so each batch holds one vote per pair and votes keep their order.
+    """
+
+    def __init__(self, apply, interval: float, max_size: int):
+        self.apply = apply
+        self.interval = interval
+        self.max_size = max_size
+        self._pending: dict[tuple[int, int], tuple[int, asyncio.Future]] = {}
+        self._deferred: list[tuple[tuple[int, int], int, asyncio.Future]] = []
+        self._full = asyncio.Event()
+        self._flushing = asyncio.Lock()
+        self._task = None
+        self._closed = False
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending) + len(self._deferred)
+
+    async def submit(self, user_id: int, post_id: int, dir: int) -> str:
+        """Queues a vote and returns its outcome once the batch holding it is committed."""
+        if self._closed:
+            raise RuntimeError("The vote buffer is shut down")
+        future = asyncio.get_running_loop().create_future()
+        key = (user_id, post_id)
+        if key in self._pending:
+            self._deferred.append((key, dir, future))
+        else:
+            self._pending[key] = (dir, future)
+        if len(self._pending) >= self.max_size:
+            self._full.set()
+        return await future
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        _running.append(self)
+
+    async def close(self):
+        """Stops the periodic flush and writes whatever is still queued."""
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        while self.depth:
+            await self.flush()
+        _running.remove(self)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        async with self._flushing:
+            self._full.clear()
+            batch, self._pending = self._pending, {}
+            # Votes that waited for their pair's previous vote join the next batch, in arrival order
+            deferred, self._deferred = self._deferred, []
+            for key, dir, future in deferred:
+                if key in self._pending:
+                    self._deferred.append((key, dir, future))
+                else:
+                    self._pending[key] = (dir, future)
+            if not batch:
+                return
+
+            started = time.perf_counter()
+            await self._write(batch)
+            vote_batch_seconds.observe(time.perf_counter() - started)
+            vote_batch_size.observe(len(batch))
+
+    async def _write(self, batch: dict[tuple[int, int], tuple[int, asyncio.Future]]):
+        try:
+            outcome = await database.run_in_session(self.apply, {key: dir for key, (dir, _) in batch.items()})
+        except (exc.IntegrityError, exc.DataError) as error:
+            if len(batch) == 1:
+                self._fail(batch, error)
+                return
+            # Caused by some of the votes: write each half on its own, so the others still go through
+            votes = list(batch.items())
+            await self._write(dict(votes[:len(votes) // 2]))
+            await self._write(dict(votes[len(votes) // 2:]))
+            return
+        except Exception as error:
+            self._fail(batch, error)
+            return
+
+        for key, (_, future) in batch.items():
+            if not future.done():
+                future.set_result(outcome[key])
+
+    def _fail(self, batch: dict[tuple[int, int], tuple[int, asyncio.Future]], error: Exception):
+        vote_batch_errors_total.inc()
+        logger.error("Writing a batch of %d vote(s) failed", len(batch), exc_info=error)
+        for _, future in batch.values():
+            if not future.done():
+                future.set_exception(error)
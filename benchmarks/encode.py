@@ -0,0 +1,76 @@
+"""
+Micro-benchmark of response encoding: time to turn a page of PostWithVotes into JSON bytes with each
+JSON_RESPONSE_BACKEND, the way FastAPI does it for a route with a response_model (validate the
+returned objects, dump them to JSON-compatible Python, render with the response class). The
+projected read path of GET /posts/ (pre-shaped dicts straight to orjson) is listed for reference.
+No database needed.
+
+    python -m benchmarks.encode --posts 100
+"""
+import argparse
+import timeit
+from datetime import datetime, timedelta, timezone
+from typing import List
+from pydantic import TypeAdapter
+from app import schemas
+from app.responses import dumps, response_class
+
+BACKENDS = ("stdlib", "orjson", "msgspec")
+
+
+def build_page(posts: int) -> list[schemas.PostWithVotes]:
+    now = datetime.now(timezone.utc)
+    return [
+        schemas.PostWithVotes(
+            Post=schemas.Post(
+                id=index,
+                title=f"Post number {index}",
+                content="Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4,
+                is_published=True,
+                created_at=now - timedelta(minutes=index),
+                owner=schemas.UserResponse(id=index % 50, email=f"user{index % 50}@example.com", created_at=now - timedelta(days=30)),
+            ),
+            votes=index * 7 % 300,
+        )
+        for index in range(posts)
+    ]
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.encode", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=100, help="posts per page")
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs per backend (best one is reported)")
+    args = parser.parse_args(argv)
+
+    page = build_page(args.posts)
+    adapter = TypeAdapter(List[schemas.PostWithVotes])
+    content = adapter.dump_python(page, mode="json")
+    # The projected read path's rows, already in response shape (datetimes still datetimes)
+    shaped = adapter.dump_python(page)
+
+    def best_of(run) -> float:
+        number = max(1, 2000 // max(1, args.posts))
+        return min(timeit.repeat(run, number=number, repeat=args.repeat)) / number
+
+    print(f"{args.posts} posts per page, best of {args.repeat} runs")
+    print(f"{'encoder':<22}{'response us':>13}{'render us':>11}{'render vs stdlib':>18}")
+    print("-" * 64)
+    stdlib_render = None
+    for backend in BACKENDS:
+        try:
+            cls = response_class(backend)
+        except RuntimeError as error:
+            print(f"{backend:<22}skipped: {error}")
+            continue
+        # Full response_model path: validate the returned objects, dump to JSON-compatible data, render
+        response = best_of(lambda: cls(adapter.dump_python(adapter.validate_python(page), mode="json")).body)
+        render = best_of(lambda: cls(content).body)
+        stdlib_render = stdlib_render or render
+        print(f"{backend:<22}{response * 1e6:>13.1f}{render * 1e6:>11.1f}{stdlib_render / render:>17.2f}x")
+
+    projection = best_of(lambda: dumps(shaped))
+    print(f"{'projection (orjson)':<22}{projection * 1e6:>13.1f}{'':>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Import-time budget. Starts fresh interpreters with `python -X importtime`, builds the app the way a
+new worker does (import app.main, then create_app()), and reports the time spent importing, the
+slowest packages and every app module. Exits with status 1 when the median run is over --budget-ms,
+or when one of LAZY_MODULES was imported: those belong to the lifespan or to the first request.
+
+    python -m benchmarks.importtime                       # check against the default budget
+    python -m benchmarks.importtime --budget-ms 900 --runs 10
+
+Needs no database: nothing connects before the lifespan runs. The DATABASE_* settings must still be
+set (create_app() reads the settings), as for the app itself.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+STATEMENT = "import app.main; app.main.create_app()"
+
+# Imported by the lifespan (engines) or on first use (password hashing), never while building the app
+LAZY_MODULES = ("psycopg", "pwdlib", "argon2")
+
+
+def measure(statement: str) -> list[tuple[str, int, int, int]]:
+    """(module, depth, self µs, cumulative µs) for every module imported by `statement` in a new interpreter."""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise SystemExit(f"`{statement}` failed:\n{completed.stderr[-2000:]}")
+    modules = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return modules
+
+
+def total_ms(modules: list[tuple[str, int, int, int]]) -> float:
+    return sum(cumulative for _, depth, _, cumulative in modules if depth == 0) / 1000
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.importtime", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=1200, help="import time allowed for the median run")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="packages to list, by import time")
+    parser.add_argument("--statement", default=STATEMENT, help="code to time (default: %(default)r)")
+    args = parser.parse_args(argv)
+
+    # The first run also warms the bytecode cache, so it isn't counted
+    measure(args.statement)
+    runs = [measure(args.statement) for _ in range(args.runs)]
+    totals = [total_ms(modules) for modules in runs]
+    median = statistics.median(totals)
+    modules = runs[totals.index(sorted(totals)[len(totals) // 2])]
+
+    packages = defaultdict(int)
+    for name, _, self_us, _ in modules:
+        packages[name.split(".")[0]] += self_us
+    print(f"{'ms':>8}  package (self time of all its modules)")
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{self_us / 1000:>8.1f}  {package}")
+    print(f"\n{'self ms':>8} {'cum. ms':>8}  app module")
+    for name, _, self_us, cumulative_us in modules:
+        if name == "app" or name.startswith("app."):
+            print(f"{self_us / 1000:>8.1f} {cumulative_us / 1000:>8.1f}  {name}")
+
+    failures = []
+    if median > args.budget_ms:
+        failures.append(f"median import time {median:.0f} ms is above --budget-ms {args.budget_ms:.0f}")
+    imported = {name for name, *_ in modules}
+    for lazy in LAZY_MODULES:
+        if lazy in imported:
+            failures.append(f"{lazy} was imported while building the app")
+
+    print(f"\nimport time: median {median:.0f} ms, min {min(totals):.0f} ms, max {max(totals):.0f} ms over {args.runs} run(s)", file=sys.stderr)
+    for failure in failures:
+        print(f"FAIL  {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
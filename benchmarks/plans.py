@@ -0,0 +1,177 @@
+"""
+Query plan checks. Drives every route in-process (like benchmarks.run) against the seeded benchmark
+database, records each SQL statement the routers send, and EXPLAINs it together with the lookups
+Postgres runs for ON DELETE CASCADE. Exits with status 1 when a plan sequentially scans a large
+table, costs more than --max-cost, or (with --compare) costs more than --max-growth times what it
+did in an earlier run.
+
+    python -m benchmarks.plans --seed                    # seed (same dataset as benchmarks.run), then check
+    python -m benchmarks.plans --output plans.json       # check and save the plan costs
+    python -m benchmarks.plans --compare plans.json      # also fail on cost regressions
+
+Run it on a seeded database: on nearly empty tables the planner rightly prefers sequential scans.
+"""
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+import httpx
+from sqlalchemy import event, func, select, text
+from app import database, models
+from app.config import settings
+from app.instrumentation import normalize_sql
+from app.main import app
+from .seed import BENCH_PASSWORD, seed
+
+# What Postgres does for each ON DELETE CASCADE foreign key (posts.owner_id, votes.*, ...)
+CASCADE_LOOKUPS = (
+    ("cascade users -> posts", "DELETE FROM posts WHERE owner_id = %(id)s"),
+    ("cascade users -> votes", "DELETE FROM votes WHERE user_id = %(id)s"),
+    ("cascade users -> refresh_tokens", "DELETE FROM refresh_tokens WHERE user_id = %(id)s"),
+    ("cascade posts -> votes", "DELETE FROM votes WHERE post_id = %(id)s"),
+    ("cascade posts -> post_scores", "DELETE FROM post_scores WHERE post_id = %(id)s"),
+)
+
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+class StatementRecorder:
+    """Keeps the first occurrence of every distinct (normalized) statement sent while a label is set."""
+
+    def __init__(self):
+        self.label = None
+        self.statements = {}  # normalized SQL -> (label, statement, parameters)
+        engines = [database.engine] + ([database.async_engine.sync_engine] if database.async_engine is not None else [])
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.label is None or executemany or not statement.lstrip().upper().startswith(_EXPLAINABLE):
+            return
+        self.statements.setdefault(normalize_sql(statement), (self.label, statement, parameters))
+
+
+async def exercise_routes(client: httpx.AsyncClient, recorder: StatementRecorder, user_id: int, email: str):
+    """Calls every route once (twice for the paths with distinct queries) as a seeded user."""
+
+    async def call(label: str, method: str, url: str, **kwargs) -> httpx.Response:
+        recorder.label = label
+        try:
+            response = await client.request(method, url, **kwargs)
+        finally:
+            recorder.label = None
+        if response.status_code >= 400:
+            raise SystemExit(f"{label}: unexpected {response.status_code} {response.text[:200]}")
+        return response
+
+    tokens = (await call("POST /auth/login", "POST", "/auth/login", data={"username": email, "password": BENCH_PASSWORD})).json()
+    auth = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    feed = await call("GET /posts/", "GET", "/posts/?limit=10", headers=auth)
+    await call("GET /posts/ (cursor)", "GET", "/posts/", params={"limit": 10, "after": feed.headers["X-Next-Cursor"]}, headers=auth)
+    await call("GET /posts/ (skip)", "GET", "/posts/?limit=10&skip=1000", headers=auth)
+    # Every seeded post contains most of the seed's ten words, so search for words outside them: the
+    # planner then sees a selective term like a real search, and the trigram fallback runs as well
+    await call("GET /posts/ (search)", "GET", "/posts/?search=replication", headers=auth)
+    await call("GET /posts/trending", "GET", "/posts/trending", headers=auth)
+    post_id = feed.json()[0]["Post"]["id"]
+    await call("GET /posts/{id}", "GET", f"/posts/{post_id}")
+    await call("GET /posts/export (owner)", "GET", "/posts/export", params={"owner_id": user_id}, headers=auth)
+    newest, oldest = feed.json()[0]["Post"]["created_at"], feed.json()[-1]["Post"]["created_at"]
+    await call("GET /posts/export (created_at)", "GET", "/posts/export", params={"created_after": oldest, "created_before": newest}, headers=auth)
+    await call("GET /vote/export (user)", "GET", "/vote/export", params={"user_id": user_id}, headers=auth)
+    await call("GET /vote/export (post)", "GET", "/vote/export", params={"post_id": post_id}, headers=auth)
+    await call("GET /users/{id}", "GET", f"/users/{user_id}")
+
+    created = (await call("POST /posts/", "POST", "/posts/", json={"title": "plan check", "content": "plan check"}, headers=auth)).json()
+    await call("PUT /posts/{id}", "PUT", f"/posts/{created['id']}", json={"title": "plan check", "content": "updated"}, headers=auth)
+    await call("POST /vote/", "POST", "/vote/", json={"post_id": created["id"], "dir": 1}, headers=auth)
+    await call("POST /vote/batch", "POST", "/vote/batch", json={"votes": [{"post_id": created["id"], "dir": 0}, {"post_id": post_id, "dir": 0}]}, headers=auth)
+    await call("DELETE /posts/{id}", "DELETE", f"/posts/{created['id']}", headers=auth)
+
+    rotated = (await call("POST /auth/refresh", "POST", "/auth/refresh", json={"refresh_token": tokens["refresh_token"]})).json()
+    await call("POST /auth/logout", "POST", "/auth/logout", json={"refresh_token": rotated["refresh_token"]})
+    await call("POST /auth/logout-all", "POST", "/auth/logout-all", headers={"Authorization": f"Bearer {rotated['access_token']}"})
+
+
+def _plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def check_plan(plan: dict, table_rows: dict, min_rows: int, max_cost: float, baseline_cost: float | None, max_growth: float) -> list[str]:
+    problems = []
+    for node in _plan_nodes(plan):
+        relation = node.get("Relation Name")
+        if node["Node Type"] == "Seq Scan" and table_rows.get(relation, 0) >= min_rows:
+            problems.append(f"Seq Scan on {relation} (~{table_rows[relation]} rows)")
+    cost = plan["Total Cost"]
+    if cost > max_cost:
+        problems.append(f"cost {cost:.0f} is above --max-cost {max_cost:.0f}")
+    if baseline_cost and cost > baseline_cost * max_growth:
+        problems.append(f"cost {cost:.0f} is {cost / baseline_cost:.1f}x the baseline's {baseline_cost:.0f}")
+    return problems
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.plans", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", action="store_true", help="DROP all tables in the configured database and seed it first")
+    parser.add_argument("--min-rows", type=int, default=5000, help="tables at least this large must not be sequentially scanned")
+    parser.add_argument("--max-cost", type=float, default=20000, help="planner cost budget per statement")
+    parser.add_argument("--max-growth", type=float, default=2.0, help="allowed cost growth against --compare")
+    parser.add_argument("--output", type=Path, help="save the plan costs as JSON")
+    parser.add_argument("--compare", type=Path, help="earlier --output to compare costs against")
+    args = parser.parse_args(argv)
+
+    if args.seed:
+        print(f"Seeding {settings.database_name}")
+        seed(1000, 20000, 100000, 20000)
+
+    db = database.SessionLocal()
+    try:
+        user_id, email = db.execute(
+            select(models.User.id, models.User.email).join(models.Post, models.Post.owner_id == models.User.id).limit(1)
+        ).one()
+        post_id = db.scalar(select(func.max(models.Post.id)))
+    finally:
+        db.close()
+
+    recorder = StatementRecorder()
+
+    async def run():
+        # With the lifespan, as in benchmarks.run (the vote buffer only runs inside it)
+        async with app.router.lifespan_context(app), httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://plans") as client:
+            await exercise_routes(client, recorder, user_id, email)
+    asyncio.run(run())
+
+    statements = list(recorder.statements.items())
+    statements += [(normalize_sql(sql), (label, sql, {"id": user_id if label.startswith("cascade users") else post_id})) for label, sql in CASCADE_LOOKUPS]
+    baseline = json.loads(args.compare.read_text()) if args.compare else {}
+
+    costs = {}
+    failures = 0
+    with database.engine.connect() as connection:
+        table_rows = dict(connection.execute(text(
+            "SELECT relname, reltuples::bigint FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace"
+        )).all())
+        for normalized, (label, statement, parameters) in statements:
+            plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()[0]["Plan"]
+            costs[normalized] = plan["Total Cost"]
+            problems = check_plan(plan, table_rows, args.min_rows, args.max_cost, baseline.get(normalized), args.max_growth)
+            failures += bool(problems)
+            print(f"{'FAIL' if problems else 'ok':<6}{plan['Total Cost']:>10.1f}  {label}: {normalized[:100]}")
+            for problem in problems:
+                print(f"{'':<18}{problem}")
+        connection.rollback()
+
+    print(f"\n{len(statements)} statement(s) checked, {failures} failed", file=sys.stderr)
+    if args.output:
+        args.output.write_text(json.dumps(costs, indent=2))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
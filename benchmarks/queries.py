@@ -0,0 +1,96 @@
+"""
+Statements per page. Fetches the post list routes in-process at a small and a large page size, with
+the response cache off, and compares the SQL statements each page took, as counted by the request
+instrumentation (the Server-Timing header). Exits with status 1 when a route needs more statements
+for the larger page, as it would if owners or vote counts were loaded one row at a time (N+1).
+Both the projected and the ORM read paths are checked.
+
+    python -m benchmarks.queries --seed                  # seed (same dataset as benchmarks.run), then check
+    python -m benchmarks.queries --limits 10 100 500
+
+Needs a database with more posts than the largest --limits, and SERVER_TIMING on (the default).
+"""
+import argparse
+import asyncio
+import re
+import sys
+import httpx
+from sqlalchemy import select
+from app import database, models, oauth2
+from app.cache import NullCacheBackend, get_response_cache
+from app.config import get_settings, settings
+from app.main import app
+from .seed import seed
+
+ROUTES = (
+    ("GET /posts/", "/posts/", "post_projection_reads_feed"),
+    ("GET /posts/ (skip)", "/posts/?skip=1000", "post_projection_reads_feed"),
+    ("GET /posts/trending", "/posts/trending", "post_projection_reads_trending"),
+)
+
+_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+async def count_queries(client: httpx.AsyncClient, url: str, limit: int, headers: dict) -> tuple[int, int]:
+    """(statements, posts) for one page of `url`."""
+    response = await client.get(url, params={"limit": limit}, headers=headers)
+    if response.status_code != 200:
+        raise SystemExit(f"{url}: unexpected {response.status_code} {response.text[:200]}")
+    match = _QUERIES.search(response.headers.get("server-timing", ""))
+    if match is None:
+        raise SystemExit("No query count in the Server-Timing header: run with SERVER_TIMING=true")
+    return int(match.group(1)), len(response.json())
+
+
+async def check_routes(client: httpx.AsyncClient, limits: list[int], headers: dict) -> int:
+    failures = 0
+    for projection in (True, False):
+        for label, url, route_setting in ROUTES:
+            setattr(get_settings(), route_setting, projection)
+            # The first page also fills the user cache, so it isn't counted
+            await count_queries(client, url, limits[0], headers)
+            counts = [await count_queries(client, url, limit, headers) for limit in limits]
+            problems = []
+            if len({queries for queries, _ in counts}) > 1:
+                problems.append("statements grow with the page size")
+            if counts[-1][1] <= counts[0][1]:
+                problems.append(f"the largest page has {counts[-1][1]} post(s): seed a larger database")
+            failures += bool(problems)
+            pages = ", ".join(f"limit={limit}: {queries} statement(s) for {posts} post(s)" for limit, (queries, posts) in zip(limits, counts))
+            print(f"{'FAIL' if problems else 'ok':<6}{label} ({'projection' if projection else 'ORM'}): {pages}")
+            for problem in problems:
+                print(f"{'':<6}{problem}")
+    return failures
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.queries", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", action="store_true", help="DROP all tables in the configured database and seed it first")
+    parser.add_argument("--limits", type=int, nargs="+", default=[10, 100], help="page sizes to compare")
+    args = parser.parse_args(argv)
+
+    if args.seed:
+        print(f"Seeding {settings.database_name}")
+        seed(1000, 20000, 100000, 20000)
+
+    db = database.SessionLocal()
+    try:
+        user_id = db.scalar(select(models.User.id).limit(1))
+    finally:
+        db.close()
+    headers = {"Authorization": f"Bearer {oauth2.create_access_token({'user_id': user_id})}"}
+
+    async def run():
+        async with app.router.lifespan_context(app), httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://queries") as client:
+            # A cached page takes no statement at all, whatever it would have cost
+            get_response_cache().backend = NullCacheBackend()
+            return await check_routes(client, sorted(args.limits), headers)
+    failures = asyncio.run(run())
+
+    print(f"\n{len(ROUTES) * 2} route(s) checked, {failures} failed", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Benchmarks the API hot paths in-process (ASGI, no network) against the database configured by
+the usual DATABASE_* settings, and saves the results as JSON so runs can be diffed between commits.
+
+    python -m benchmarks.run --seed                 # recreate + seed the database, then run
+    python -m benchmarks.run --compare base.json    # run and print the change against an older result
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+import httpx
+from sqlalchemy import event, func, select
+from app import database, models, oauth2
+from app.config import settings
+from app.main import app
+from .seed import BENCH_PASSWORD, seed
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+class QueryCounter:
+    """Counts statements sent to the database by the sync and async engines."""
+
+    def __init__(self):
+        self.count = 0
+        engines = [database.engine] + ([database.async_engine.sync_engine] if database.async_engine is not None else [])
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+class Scenario:
+    """One endpoint under test. build() returns (method, url, request kwargs) for the next request."""
+
+    def __init__(self, name: str, build, expected_status: tuple = (200,)):
+        self.name = name
+        self.build = build
+        self.expected_status = expected_status
+
+
+def _percentile(sorted_values: list, percent: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int, counter: QueryCounter) -> dict:
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, url, kwargs = scenario.build()
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code not in scenario.expected_status:
+                errors += 1
+
+    queries_before = counter.count
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50) * 1000, 2),
+            "p95": round(_percentile(latencies, 95) * 1000, 2),
+            "p99": round(_percentile(latencies, 99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "queries_per_request": round((counter.count - queries_before) / requests, 2),
+    }
+
+
+def build_scenarios(names: list, rng: random.Random, requests: int, warmup: int) -> list:
+    db = database.SessionLocal()
+    try:
+        user_ids = db.scalars(select(models.User.id).limit(1000)).all()
+        max_post_id = db.scalar(select(func.max(models.Post.id))) or 1
+        # Refresh tokens are single use (rotation), so mint one per request (warmup included) through the app itself
+        refresh_tokens = [oauth2.create_refresh_token(rng.choice(user_ids), db) for _ in range(requests + warmup)] if "refresh" in names else []
+    finally:
+        db.close()
+
+    tokens = {user_id: oauth2.create_access_token({"user_id": user_id}) for user_id in user_ids}
+
+    def auth_headers():
+        return {"headers": {"Authorization": f"Bearer {tokens[rng.choice(user_ids)]}"}}
+
+    # Alternating up/down votes keep vote counts stable across runs
+    vote_state = {}
+    def next_vote():
+        user_id, post_id = rng.choice(user_ids), rng.randint(1, max_post_id)
+        direction = vote_state.get((user_id, post_id), 0) ^ 1
+        vote_state[(user_id, post_id)] = direction
+        return ("POST", "/vote/", {"json": {"post_id": post_id, "dir": direction}, "headers": {"Authorization": f"Bearer {tokens[user_id]}"}})
+
+    scenarios = {
+        "posts_feed": Scenario("posts_feed", lambda: ("GET", "/posts/?limit=10", auth_headers())),
+        "posts_deep_page": Scenario("posts_deep_page", lambda: ("GET", f"/posts/?limit=10&skip={rng.randint(0, max_post_id // 2)}", auth_headers())),
+        # Large pages under load; benchmarks.queries checks that their statement count doesn't grow with the page size
+        "posts_feed_large": Scenario("posts_feed_large", lambda: ("GET", f"/posts/?limit=100&skip={rng.randint(0, 1000)}", auth_headers())),
+        "posts_trending": Scenario("posts_trending", lambda: ("GET", "/posts/trending?limit=10", auth_headers())),
+        "post_detail": Scenario("post_detail", lambda: ("GET", f"/posts/{rng.randint(1, max_post_id)}", {})),
+        # already_voted/not_voted collisions are expected with random users, they still exercise the write path
+        "vote": Scenario("vote", next_vote, expected_status=(201, 404, 409)),
+        "login": Scenario("login", lambda: ("POST", "/auth/login", {"data": {"username": f"user{rng.choice(user_ids)}@bench.example.com", "password": BENCH_PASSWORD}})),
+        "refresh": Scenario("refresh", lambda: ("POST", "/auth/refresh", {"json": {"refresh_token": refresh_tokens.pop()}})),
+    }
+    return [scenarios[name] for name in names]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(results: dict, baseline: dict | None = None):
+    header = f"{'scenario':<16}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'q/req':>8}{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, result in results["scenarios"].items():
+        latency = result["latency_ms"]
+        print(f"{name:<16}{result['throughput_rps']:>10}{latency['p50']:>10}{latency['p95']:>10}{latency['p99']:>10}{result['queries_per_request']:>8}{result['errors']:>8}")
+        base = (baseline or {}).get("scenarios", {}).get(name)
+        if base:
+            def change(new, old):
+                return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"{'  vs baseline':<16}{change(result['throughput_rps'], base['throughput_rps']):>10}"
+                  f"{change(latency['p50'], base['latency_ms']['p50']):>10}{change(latency['p95'], base['latency_ms']['p95']):>10}"
+                  f"{change(latency['p99'], base['latency_ms']['p99']):>10}")
+
+
+async def main_async(args):
+    rng = random.Random(args.random_seed)
+    warmup = min(args.requests, args.concurrency * 2)
+    scenarios = build_scenarios(args.scenarios, rng, args.requests, warmup)
+    counter = QueryCounter()
+
+    results = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "settings": {
+            "database_async": settings.database_async,
+            "response_cache_backend": settings.response_cache_backend,
+            "vote_batch_writes": settings.vote_batch_writes,
+        },
+        "scenarios": {},
+    }
+    transport = httpx.ASGITransport(app=app)
+    # ASGITransport doesn't run the lifespan: run it here so the pool prewarm, the vote buffer
+    # (VOTE_BATCH_WRITES) and the other background tasks are there as in a real worker
+    async with app.router.lifespan_context(app), httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for scenario in scenarios:
+            # Warm up pools and caches so the first requests don't skew the percentiles
+            await run_scenario(client, scenario, warmup, args.concurrency, counter)
+            results["scenarios"][scenario.name] = await run_scenario(client, scenario, args.requests, args.concurrency, counter)
+    return results
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", action="store_true", help="DROP all tables in the configured database and seed it first")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--votes", type=int, default=100000)
+    parser.add_argument("--refresh-tokens", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--scenarios", nargs="+", default=["posts_feed", "posts_deep_page", "posts_feed_large", "posts_trending", "post_detail", "vote", "login", "refresh"])
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="where to save the JSON results (default: benchmarks/results/)")
+    parser.add_argument("--compare", type=Path, help="earlier JSON result to compare against")
+    args = parser.parse_args(argv)
+
+    if args.seed:
+        print(f"Seeding {settings.database_name}: {args.users} users, {args.posts} posts, {args.votes} votes, {args.refresh_tokens} refresh tokens")
+        seed(args.users, args.posts, args.votes, args.refresh_tokens, seed_value=args.random_seed)
+
+    results = asyncio.run(main_async(args))
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_report(results, baseline)
+
+    output = args.output or RESULTS_DIR / f"{results['timestamp'][:19].replace(':', '')}-{results['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nSaved {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Seeds the configured database (DATABASE_* settings) with synthetic users, posts, votes and
+refresh tokens for the benchmarks. Drops and recreates every table first, so point it at a
+dedicated benchmark database, never at real data.
+"""
+import random
+import secrets
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import insert, text
+from app import models
+from app import database
+from app.maintenance import reconcile_vote_counts
+from app.trending import refresh_trending_scores
+from app.oauth2 import hash_refresh_token
+from app.utils import hash_password
+
+# Every seeded user shares this password, so the login scenario can authenticate as anyone
+BENCH_PASSWORD = "benchmark-password"
+
+BATCH_SIZE = 5000
+
+
+def _insert_batches(connection, table, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        connection.execute(insert(table), rows[start:start + BATCH_SIZE])
+
+
+def seed(users: int, posts: int, votes: int, refresh_tokens: int, seed_value: int = 0):
+    """Recreate the schema and fill it with the given volumes."""
+    rng = random.Random(seed_value)
+    models.Base.metadata.drop_all(database.engine)
+    with database.engine.begin() as connection:
+        # The title trigram index needs pg_trgm; skip it if the server doesn't ship the extension
+        try:
+            with connection.begin_nested():
+                connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        except Exception:
+            models.Post.__table__.indexes.discard(
+                next(index for index in models.Post.__table__.indexes if index.name == "ix_posts_title_trgm")
+            )
+    models.Base.metadata.create_all(database.engine)
+
+    # Hashing is deliberately slow, so all users share one hash
+    password = hash_password(BENCH_PASSWORD)
+    now = datetime.now(timezone.utc)
+    words = ["fastapi", "python", "postgres", "async", "cache", "index", "vote", "feed", "search", "token"]
+
+    with database.engine.begin() as connection:
+        _insert_batches(connection, models.User.__table__, [
+            {"id": user_id, "email": f"user{user_id}@bench.example.com", "password": password}
+            for user_id in range(1, users + 1)
+        ])
+        _insert_batches(connection, models.Post.__table__, [
+            {
+                "id": post_id,
+                "title": " ".join(rng.choices(words, k=4)),
+                "content": " ".join(rng.choices(words, k=40)),
+                "owner_id": rng.randint(1, users),
+                "created_at": now - timedelta(seconds=posts - post_id),
+            }
+            for post_id in range(1, posts + 1)
+        ])
+
+        # Distinct (user, post) pairs, skewed towards recent posts like a real feed
+        pairs = set()
+        votes = min(votes, users * posts)
+        while len(pairs) < votes:
+            post_id = posts - min(int(rng.expovariate(1 / max(posts / 10, 1))), posts - 1)
+            pairs.add((rng.randint(1, users), post_id))
+        _insert_batches(connection, models.Vote.__table__, [{"user_id": u, "post_id": p} for u, p in pairs])
+
+        # Table volume only; the refresh scenario mints its own tokens through the app
+        _insert_batches(connection, models.RefreshToken.__table__, [
+            {"user_id": rng.randint(1, users), "token_hash": hash_refresh_token(secrets.token_urlsafe(32)), "expires_at": now + timedelta(days=30)}
+            for _ in range(refresh_tokens)
+        ])
+
+        # Explicit ids were used, move the sequences past them
+        for table in ("users", "posts", "refresh_tokens"):
+            connection.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT coalesce(max(id), 1) FROM {table}))"))
+
+    db = database.SessionLocal()
+    try:
+        reconcile_vote_counts(db)
+        refresh_trending_scores(db)
+    finally:
+        db.close()
+
+    with database.engine.begin() as connection:
+        connection.execute(text("ANALYZE"))